@@ -30,15 +30,35 @@ Provide search results and URLs for <query> using Wikipedia's API
 Alfred Wikipedia Search Module
 
 Usage:
+    search.py <query>
+    search.py --record-responses <query>...
+    search.py --benchmark
+    search.py --metrics
 
 """
 
+import os
+import re
 import sys
+import random
+import time
+import urllib
+import hashlib
+import threading
+import Queue
 import requests
 import json
 from pprint import pprint
 from collections import OrderedDict
 from workflow import Workflow3, ICON_WEB, ICON_WARNING
+from workflow.bloom import BloomFilter
+from workflow.background import run_in_background, run_scheduled, schedule
+from workflow.cachemanager import CacheManager
+from workflow.circuitbreaker import CircuitBreaker, CircuitOpen
+from workflow.hotcache import HotCache
+from workflow.querylog import QueryLog
+from workflow.ratelimit import RateLimited, TokenBucket
+from workflow.workflow import LockFile, atomic_writer
 
 BASE_URL = 'https://en.wikipedia.org/'
 API_URL = BASE_URL + 'w/api.php'
@@ -46,6 +66,140 @@ WEB_URL = BASE_URL + 'wiki/'
 MOBILE_URL = 'https://en.m.wikipedia.org/wiki/'
 HEADERS = {'user-agent': 'Alfred Wikipedia Search 0.0.1'}
 
+# How long search results are cached for, in seconds
+CACHE_MAX_AGE = 600
+# How long to wait for another process fetching the same query, in seconds
+COALESCE_TIMEOUT = 5
+# Budget for the whole cache directory
+CACHE_MAX_BYTES = 20 * 1024 * 1024
+CACHE_MAX_ENTRIES = 1000
+# Per-query caches are deleted this long after they were written
+CACHE_TTL = 24 * 60 * 60
+# Per-page extract caches are deleted this long after they were written
+EXTRACT_TTL = 7 * 24 * 60 * 60
+# Size of chunks responses are read in between cancellation checks
+CHUNK_SIZE = 8192
+# Results per page, and the character that asks for the next page when
+# appended to a query ("einstein ››" shows the first three pages)
+PAGE_SIZE = 10
+MORE_MARKER = '›'
+# Length of extracts: about what fits in Alfred's subtitle and a few
+# lines of large type
+EXTRACT_CHARS = 250
+# Queries up to this long may be answered by title prefix search
+PREFIX_MAX_CHARS = 4
+# How long queries without results are remembered, in seconds, and at
+# most how many
+NEGATIVE_TTL = 60 * 60
+NEGATIVE_MAX_ENTRIES = 2000
+# How quickly measured latencies replace older ones (0-1), and how often
+# to try a strategy other than the fastest one
+LATENCY_WEIGHT = 0.2
+EXPLORE_RATE = 0.1
+# How often the results of the most frequent queries are refreshed,
+# in seconds, and how many of them
+WARM_INTERVAL = CACHE_MAX_AGE // 2
+WARM_QUERIES = 10
+# Speculative prefetching (opt-in with the `prefetch` workflow variable):
+# how many predicted queries to fetch after each search, and at most how
+# many fetches to make per `PREFETCH_PERIOD` seconds
+PREFETCH_COUNT = 3
+PREFETCH_RATE = 12
+PREFETCH_PERIOD = 60
+# Mobile pages of the top results are downloaded for Quick Look: how
+# many per search, how many are kept, and for how long, in seconds
+QUICKLOOK_COUNT = 3
+QUICKLOOK_MAX_PAGES = 50
+QUICKLOOK_MAX_AGE = 24 * 60 * 60
+# Time budget of a search in seconds, unless set with the `time_budget`
+# workflow variable or setting, and the share of it by which each stage
+# must be done (time a stage doesn't use is left to later ones).
+# Thumbnails are fetched while parsing.
+TIME_BUDGET = 3.0
+STAGE_DEADLINES = {'titles': 0.5, 'extracts': 0.8, 'parse': 1.0}
+# Timeout of requests made outside searches, in seconds, and the
+# shortest timeout ever used (0 would mean none)
+REQUEST_TIMEOUT = 30
+MIN_TIMEOUT = 0.01
+# Requests to an endpoint time out after this many times its 99th
+# percentile latency, but no sooner than `MIN_REQUEST_TIMEOUT` seconds.
+# Probes of failing endpoints wait up to `PROBE_TIMEOUT` seconds.
+TIMEOUT_FACTOR = 3
+MIN_REQUEST_TIMEOUT = 1.0
+PROBE_TIMEOUT = 10
+# With several equivalent API URLs (the `api_urls` workflow variable or
+# setting), a request is sent to a second one if the first hasn't
+# answered within its 90th percentile latency, or this many seconds
+# while that isn't known yet
+HEDGE_DELAY = 1.0
+# Limit on API requests shared by all runs: tokens added per second,
+# the longest burst, and how many tokens are kept for searches (which
+# background requests can't take). Background requests also ask the API
+# to refuse them while its database replicas lag more than `MAXLAG`
+# seconds. Refused requests pause all requests for as long as the
+# `Retry-After` header says, or `RETRY_AFTER` seconds.
+API_RATE = 5
+API_BURST = 20
+API_RESERVE = 5
+MAXLAG = 5
+RETRY_AFTER = 5
+
+# Wikipedia search parameters: list-of-pages output with the ranked
+# titles and their latest revision IDs. Extracts are fetched separately
+# with `EXTRACT_PARAMS`, and only if they're not cached.
+SEARCH_PARAMS = {
+    'action': 'query',
+    'format': 'json',
+    'formatversion': 2,
+    'generator': 'search',
+    'gsrnamespace': 0,
+    'gsrlimit': PAGE_SIZE,
+    'redirects': 1,
+    'prop': 'info'
+}
+# Title prefix search, which is much cheaper than full-text search for
+# a few characters
+PREFIX_PARAMS = {
+    'action': 'query',
+    'format': 'json',
+    'formatversion': 2,
+    'generator': 'prefixsearch',
+    'gpsnamespace': 0,
+    'gpslimit': PAGE_SIZE,
+    'redirects': 1,
+    'prop': 'info'
+}
+EXTRACT_PARAMS = {
+    'action': 'query',
+    'format': 'json',
+    'formatversion': 2,
+    'prop': 'extracts',
+    'exintro': 1,
+    'explaintext': 1,
+    'exchars': EXTRACT_CHARS,
+    'exlimit': 20
+}
+# Parameters used before `SEARCH_PARAMS`, kept for `benchmark_profiles`
+LEGACY_SEARCH_PARAMS = {
+    'action': 'query',
+    'format': 'json',
+    'prop': 'extracts',
+    'generator': 'search',
+    'gsrnamespace': '0',
+    'gsrlimit': 10,
+    'redirects': 1,
+    'explaintext': '',
+    'exsentences': 5,
+    'exintro': 2,
+    'exlimit': 'max',
+    'excontinue': 1
+}
+# Search strategies: parameter the query goes in and other parameters
+STRATEGIES = OrderedDict([('prefix', ('gpssearch', PREFIX_PARAMS)),
+                          ('fulltext', ('gsrsearch', SEARCH_PARAMS))])
+PROFILES = OrderedDict([('legacy', LEGACY_SEARCH_PARAMS),
+                        ('diet', dict(SEARCH_PARAMS, **EXTRACT_PARAMS))])
+
 log = None
 """Debug parameter
 Possible values:
@@ -56,9 +210,293 @@ Possible values:
 """
 debug = 0
 
+class Superseded(Exception):
+    """Raised when a newer search has made this one pointless.
+
+    """
+
+class Incomplete(Exception):
+    """Raised with results that lack extracts, so they aren't cached
+    as if they were complete.
+
+    """
+
+    def __init__(self, results):
+        super(Incomplete, self).__init__(results['query'])
+        self.results = results
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage of a search has run out of time.
+
+    """
+
+class Deadline(object):
+    """Time budget of a search, split across its stages.
+
+    Each stage must be done by its share of the budget in
+    `STAGE_DEADLINES`, counted from when the search started.
+
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.started = time.time()
+
+    def remaining(self, stage=None):
+        """Return the seconds left for `stage` (or the whole search).
+
+        """
+        share = STAGE_DEADLINES.get(stage, 1.0)
+        return(self.started + self.budget * share - time.time())
+
+class Generation(object):
+    """Token that lets the latest query win.
+
+    Each run of the script writes a new token (and its normalized
+    query) to a file in the cache directory. Long-running stages call
+    `check()`, which raises `Superseded` once a newer run for a
+    different query has started, so stale runs stop using the network.
+    If the search has a `Deadline`, `check()` also raises
+    `DeadlineExceeded` once the current stage is out of time.
+
+    """
+
+    def __init__(self, wf, query, deadline=None):
+        self.path = wf.cachefile('search.generation')
+        self.key = normalize_query(wf, query)
+        self.deadline = deadline
+        self.token = '{0}:{1:f}'.format(os.getpid(), time.time())
+        try:
+            with atomic_writer(self.path, 'wb') as file_obj:
+                file_obj.write('{0}\t{1}'.format(self.token,
+                                                  self.key).encode('utf-8'))
+        except (IOError, OSError):
+            # Another run wrote its token at the same moment
+            pass
+
+    def check(self, stage=None):
+        """Raise `Superseded` if a newer search has started, or
+        `DeadlineExceeded` if `stage` is out of time.
+
+        """
+        if self.deadline is not None and self.deadline.remaining(stage) <= 0:
+            raise DeadlineExceeded(stage)
+        try:
+            with open(self.path, 'rb') as file_obj:
+                token, key = file_obj.read().decode('utf-8').split('\t', 1)
+        except (IOError, OSError, ValueError):
+            return
+        # A newer run for the same query will wait for our results
+        if token != self.token and key != self.key:
+            raise Superseded(self.key)
+
+class Hedge(object):
+    """Stand-in for `Generation` for one of two requests racing each
+    other.
+
+    `check()` raises `Superseded` once the race is over (the other
+    request has won), as well as when `generation` does.
+
+    """
+
+    def __init__(self, generation=None):
+        self.generation = generation
+        self.deadline = getattr(generation, 'deadline', None)
+        self.over = threading.Event()
+        self.recorded = set()
+        self.lock = threading.Lock()
+
+    def claim(self, url):
+        """Return whether the request to `url` is yet to be recorded
+        in the endpoint's health, and mark it as recorded.
+
+        Whoever records the request first calls this: the request
+        itself if it finishes, `request_api` if it's abandoned.
+
+        """
+        with self.lock:
+            if url in self.recorded:
+                return(False)
+            self.recorded.add(url)
+            return(True)
+
+    def check(self, stage=None):
+        """Raise `Superseded` if the race is over, or whatever
+        `generation.check()` raises.
+
+        """
+        if self.over.is_set():
+            raise Superseded('hedged request')
+        if self.generation is not None:
+            self.generation.check(stage)
+
+class Foreground(object):
+    """Stand-in for `Generation` that makes background fetches give
+    way to searches.
+
+    `check()` raises `Superseded` once any search has started since
+    this object was created. Background fetches have no deadline.
+
+    """
+
+    deadline = None
+
+    def __init__(self, wf):
+        self.path = wf.cachefile('search.generation')
+        self.started = time.time()
+
+    def check(self, stage=None):
+        """Raise `Superseded` if a search has started.
+
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime > self.started:
+            raise Superseded('foreground search')
+
+def get_time_budget(wf):
+    """Return the time budget of a search in seconds: the `time_budget`
+    workflow variable, else the setting of the same name, else
+    `TIME_BUDGET`.
+
+    """
+    value = os.getenv('time_budget') or wf.settings.get('time_budget')
+    try:
+        return(float(value or TIME_BUDGET))
+    except ValueError:
+        wf.logger.warning('Invalid time budget : %r', value)
+        return(TIME_BUDGET)
+
+def stage_timeout(generation, stage, default=REQUEST_TIMEOUT):
+    """Return how long to wait for something in `stage` of the search
+    `generation` belongs to: the time left for the stage, but no more
+    than `default`, which is also the timeout outside searches.
+
+    """
+    deadline = getattr(generation, 'deadline', None)
+    if deadline is None:
+        return(default)
+    return(min(default, max(deadline.remaining(stage), MIN_TIMEOUT)))
+
+def get_breaker(wf):
+    """Return the `CircuitBreaker` tracking the health of endpoints.
+
+    """
+    return(CircuitBreaker(wf))
+
+def get_api_urls(wf):
+    """Return the URLs of the equivalent MediaWiki APIs to use: the
+    `api_urls` workflow variable (separated by spaces or commas), else
+    the setting of the same name (a list), else `API_URL`.
+
+    """
+    value = os.getenv('api_urls', '').strip()
+    if value:
+        return(re.split(r'[\s,]+', value))
+    return(wf.settings.get('api_urls') or [API_URL])
+
+def get_rate_limiter(wf):
+    """Return the `TokenBucket` API requests draw from.
+
+    """
+    return(TokenBucket(wf, rate=API_RATE, capacity=API_BURST,
+                       reserve=API_RESERVE))
+
+def get_retry_after(r):
+    """Return the seconds response `r` asks to wait for.
+
+    """
+    try:
+        return(float(r.headers['Retry-After']))
+    except (KeyError, ValueError):
+        # No header, or a date
+        return(RETRY_AFTER)
+
+def endpoint_timeout(breaker, endpoint):
+    """Return the timeout of requests to `endpoint`, adapted to its
+    recent latency.
+
+    """
+    latency = breaker.percentile(endpoint, 99)
+    if latency is None:
+        return(REQUEST_TIMEOUT)
+    return(min(REQUEST_TIMEOUT,
+               max(MIN_REQUEST_TIMEOUT, latency * TIMEOUT_FACTOR)))
+
 def normalize(title):
     return(title.replace(' ', '_'))
 
+def env_flag(name):
+    """Whether the workflow variable `name` is set to a true value.
+
+    """
+    return(os.getenv(name, '').lower() in ('1', 'true', 'yes'))
+
+def normalize_query(wf, query):
+    """Return the canonical form of `query`, so equivalent queries
+    share a cache. The query sent to the API is left as it is.
+
+    The query is Unicode-normalized by `Workflow.decode`, whitespace is
+    collapsed and case folded. If the `fold_diacritics` workflow
+    variable is set, accented letters are replaced with plain ones.
+
+    """
+    query = ' '.join(wf.decode(query).split())
+    # Python 2 has no `unicode.casefold`
+    if hasattr(query, 'casefold'):
+        query = query.casefold()
+    else:
+        query = query.lower()
+    if env_flag('fold_diacritics'):
+        query = wf.fold_to_ascii(query)
+    return(query)
+
+def cache_name(wf, query):
+    """Return the name results for `query` are cached under.
+
+    """
+    key = normalize_query(wf, query).encode('utf-8')
+    return('search-' + hashlib.md5(key).hexdigest())
+
+def parse_page(query):
+    """Split `query` into the query proper and the number of the page
+    of results asked for (0 for the first page).
+
+    """
+    stripped = query.rstrip(MORE_MARKER + ' ')
+    return(stripped, query[len(stripped):].count(MORE_MARKER))
+
+def page_cache_name(wf, query, page):
+    """Return the name page `page` of results for `query` is cached
+    under.
+
+    """
+    name = cache_name(wf, query)
+    if page:
+        name += '-p{0}'.format(page)
+    return(name)
+
+def pack_results(query, items, after=None):
+    """Return `items` (results for `query`) in the form they are cached.
+
+    The query is saved with them to measure how often results are
+    reused for a different spelling. `after` says how to fetch the next
+    page, if there is one.
+
+    """
+    return({'query': query, 'items': items, 'after': after})
+
+def unpack_results(results):
+    """Return `(query, items, after)` from cached `results`.
+
+    """
+    # Results cached by earlier versions are plain lists
+    if isinstance(results, list):
+        return(None, results, None)
+    return(results['query'], results['items'], results.get('after'))
+
 def get_page_url(title):
     title = normalize(title)
     page_url = WEB_URL + title
@@ -74,23 +512,245 @@ def get_quicklook_url(title):
         print(quicklookurl)
     return(quicklookurl)
 
-def get_thumbnail(image_url):
-    thumb = requests.get(image_url)
+def get_quicklook_path(wf, title):
+    """Return the path the mobile page for `title` is saved at.
+
+    """
+    key = normalize(title).encode('utf-8')
+    return(wf.cachefile(os.path.join('quicklook',
+                                     hashlib.md5(key).hexdigest() + '.html')))
+
+def get_search_url(query):
+    """Return the URL of the website's search results for `query`.
+
+    """
+    return(BASE_URL + 'w/index.php?' +
+           urllib.urlencode({'search': query.encode('utf-8')}))
+
+def quicklook_cached(wf, title):
+    """Whether a recent copy of the mobile page for `title` is saved.
+
+    """
+    try:
+        mtime = os.stat(get_quicklook_path(wf, title)).st_mtime
+    except OSError:
+        return(False)
+    return(time.time() - mtime < QUICKLOOK_MAX_AGE)
+
+def get_thumbnail(image_url, generation=None):
+    if generation is not None:
+        generation.check('parse')
+    r = requests.get(image_url, stream=True,
+                     timeout=stage_timeout(generation, 'parse'))
+    thumb = read_response(r, generation, 'parse')
     return(image_url)
 
-def parse_results(results):
+def read_response(r, generation=None, stage=None):
+    """Read the body of streamed response `r`, giving up as soon as
+    `generation` is superseded or `stage` of it runs out of time.
+
+    The request's timeout only limits each wait for data, so a slow
+    trickle is stopped here.
+
+    """
+    chunks = []
+    try:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            if generation is not None:
+                generation.check(stage)
+            chunks.append(chunk)
+    finally:
+        r.close()
+    return(b''.join(chunks))
+
+def request(wf, endpoint, url, params=None, generation=None, stage=None):
+    """Return the body of the response to a request for `url` on
+    `endpoint`, made in `stage` of the search `generation` belongs to.
+
+    If the circuit of `endpoint` is open, `CircuitOpen` is raised
+    without making the request (and a probe is scheduled if due).
+    Otherwise, the request's outcome and latency are added to the
+    endpoint's health. Requests cut short by the search's time budget
+    don't count as failures. The timeout adapts to the endpoint's
+    latency (see `endpoint_timeout`), except for requests racing each
+    other (see `request_api`), which would rather be slow than fail.
+
+    Responses with a `Retry-After` header pause all requests. If the
+    request was refused because of the rate or `maxlag`, `RateLimited`
+    is raised.
+
+    """
+    breaker = get_breaker(wf)
+    if not breaker.allow(endpoint):
+        if endpoint in breaker.probes_due():
+            schedule_probes(wf)
+        raise CircuitOpen(endpoint)
+    if generation is not None:
+        generation.check(stage)
+    if isinstance(generation, Hedge):
+        # The race already deals with a slow endpoint, and the loser
+        # is abandoned anyway
+        limit = REQUEST_TIMEOUT
+    else:
+        limit = endpoint_timeout(breaker, endpoint)
+    timeout = stage_timeout(generation, stage, limit)
+    start = time.time()
+
+    def record(ok=True):
+        # An abandoned request may have been recorded by `request_api`
+        if not isinstance(generation, Hedge) or generation.claim(endpoint):
+            breaker.record(endpoint, time.time() - start, ok=ok)
+
+    try:
+        r = requests.get(url, params=params, headers=HEADERS, stream=True,
+                         timeout=timeout)
+        if 'Retry-After' in r.headers or r.status_code == 429:
+            get_rate_limiter(wf).pause(get_retry_after(r))
+        if (r.status_code == 429 or
+                r.headers.get('MediaWiki-API-Error') == 'maxlag'):
+            r.close()
+            raise RateLimited(endpoint)
+        r.raise_for_status()
+        body = read_response(r, generation, stage)
+    except DeadlineExceeded:
+        # Out of the search's time, not the endpoint's fault
+        raise
+    except requests.exceptions.Timeout:
+        # Only a failure if the endpoint had all of its own timeout
+        if timeout >= limit:
+            record(ok=False)
+        raise
+    except requests.exceptions.RequestException:
+        record(ok=False)
+        raise
+    record()
+    return(body)
+
+def request_api(wf, params, generation=None, stage=None):
+    """Return the body of the response to an API request with `params`.
+
+    With several API URLs, the request goes to the one with the lowest
+    median latency whose circuit is closed (untried ones first, ones
+    without a successful request last). If it hasn't answered within
+    its 90th percentile latency, or has failed, it is hedged: the
+    request is also sent to the next one. The first response wins. The
+    other request is abandoned and recorded with an unknown outcome, so
+    a URL that keeps losing isn't taken for an untried one.
+    URLs whose circuit is half-open are probed in the background.
+
+    Each request takes a token from the rate limiter. Searches wait
+    for one as long as their time budget allows. Background requests
+    don't wait, can't take the tokens kept for searches and set
+    `maxlag`. Without a token, `RateLimited` is raised (a hedge is
+    simply not sent).
+
+    """
+    urls = get_api_urls(wf)
+    breaker = get_breaker(wf)
+    health = breaker.health()
+    # `request()` only schedules probes for the URLs it's asked for,
+    # which are never ones with open circuits while others work
+    if any(health.get(url, {}).get('state') == 'half-open' for url in urls):
+        schedule_probes(wf)
+    urls = [url for url in urls
+            if health.get(url, {}).get('state', 'closed') == 'closed']
+    if not urls:
+        # All circuits are open, so this raises `CircuitOpen`
+        url = get_api_urls(wf)[0]
+        return(request(wf, url, url, params, generation, stage))
+
+    def rank(url):
+        stats = health.get(url, {})
+        if stats.get('p50') is not None:
+            return(stats['p50'])
+        return(float('inf') if stats.get('requests') else 0)
+    urls.sort(key=rank)
+
+    limiter = get_rate_limiter(wf)
+    foreground = getattr(generation, 'deadline', None) is not None
+    if foreground:
+        timeout = stage_timeout(generation, stage)
+    else:
+        timeout = 0
+        params = dict(params, maxlag=MAXLAG)
+    if not limiter.take(foreground, timeout):
+        raise RateLimited(urls[0])
+    if len(urls) < 2:
+        return(request(wf, urls[0], urls[0], params, generation, stage))
+
+    hedge = Hedge(generation)
+    responses = Queue.Queue()
+    # When each request was sent, until its response is in
+    started = {}
+
+    def send(url):
+        started[url] = time.time()
+
+        def run():
+            try:
+                body = request(wf, url, url, params, hedge, stage)
+            except Exception as err:
+                responses.put((url, None, err))
+            else:
+                responses.put((url, body, None))
+        thread = threading.Thread(target=run)
+        # Don't keep the script running for the losing request
+        thread.daemon = True
+        thread.start()
+
+    primary, spare = urls[0], urls[1]
+    delay = health.get(primary, {}).get('p90') or HEDGE_DELAY
+    send(primary)
+    pending = 1
+    error = None
+    try:
+        while pending:
+            try:
+                url, body, err = responses.get(
+                    timeout=delay if spare else None)
+            except Queue.Empty:
+                if limiter.take(foreground):
+                    wf.logger.debug('Hedging request to %s with %s',
+                                    primary, spare)
+                    send(spare)
+                    pending += 1
+                spare = None
+                continue
+            pending -= 1
+            del started[url]
+            if err is None:
+                # The abandoned request may never record its latency
+                for other, start in started.items():
+                    if hedge.claim(other):
+                        breaker.record(other, time.time() - start, ok=None)
+                return(body)
+            if isinstance(err, Superseded):
+                raise err
+            error = error or err
+            if spare and limiter.take(foreground):
+                send(spare)
+                pending += 1
+            spare = None
+        raise error
+    finally:
+        hedge.over.set()
+
+def parse_results(results, generation=None):
     """Parse Wikipedia (or potentially any MediaWiki) results into
     title, subtitle, etc.
 
     """
     items = []
+    # `formatversion=1` returns a dict of pages, 2 a list
+    if isinstance(results, dict):
+        results = results.values()
     # Sort the results first using Wikipedia's index to get
     # our results in the same order as Wikipedia and stop Alfred
     # from doing it instead
-    sorted_results = sorted(results.items(), key=lambda x: x[1]['index'])
+    sorted_results = sorted(results, key=lambda x: x['index'])
     if debug == 3:
         pprint(sorted_results)
-    for key, value in sorted_results:
+    for value in sorted_results:
         dct = dict()
         title = value['title']
         # Get the extract if it exists or else fail gracefully
@@ -100,11 +760,14 @@ def parse_results(results):
             subtitle = ''
         # try to get the thumbnail url and somehow get Alfred to use it?
         try:
-            image_url = get_thumbnail(value['thumbnail']['source'])
+            image_url = get_thumbnail(value['thumbnail']['source'],
+                                      generation)
             icon = dict()
             icon['type'] = 'filetype'
             icon['path'] = image_url
             dct['icon'] = icon
+        except Superseded:
+            raise
         except:
             pass
         # Get mobile page URL for quick look
@@ -127,60 +790,781 @@ def parse_results(results):
         pprint(items)
     return(items)
 
-def prepare_feedback(wf, items):
+def prepare_feedback(wf, items, more=None, stale=False):
     """Prepare Alfred results of query.
 
+    If `more` is given, a last item autocompletes it to show more
+    results. If `stale` is set, an item warns that the results may be
+    out of date.
+
     """
     if items != []:
         for item in items:
+            # Preview the saved copy of the page if there is one
+            if quicklook_cached(wf, item['title']):
+                path = get_quicklook_path(wf, item['title'])
+                item = dict(item, quicklookurl='file://' +
+                            urllib.quote(path.encode('utf-8')))
             wf.add_item(**item)
+        if stale:
+            wf.add_item('Wikipedia is slow to respond',
+                        'Some results may be out of date or missing',
+                        icon=ICON_WARNING)
+        if more is not None:
+            wf.add_item('More results…',
+                        'Show the next {0} results'.format(PAGE_SIZE),
+                        autocomplete=more)
         wf.send_feedback()
     else:
         wf.add_item('Error!', 'No results found.',
                     icon=ICON_WARNING)
         wf.send_feedback()
 
-def search(wf, query):
-    """Search Wikipedia for `query`.
+def prepare_offline_feedback(wf, query):
+    """Tell Alfred that Wikipedia didn't answer and nothing is cached
+    for `query`, and offer to search the website instead.
+
+    """
+    wf.add_item('Wikipedia is not responding',
+                'Search for “{0}” on the website instead'.format(query),
+                arg=get_search_url(query), valid=True, icon=ICON_WEB)
+    wf.send_feedback()
+
+def add_extracts(wf, pages, generation=None):
+    """Add extracts to `pages` (title search results).
+
+    Extracts are cached per page with the revision they were made
+    from, so a page's extract is only downloaded again once the page
+    has been edited. All missing extracts are fetched in one request.
+
+    Return `False` if the missing extracts were left out because they
+    took too long, the request failed or the API couldn't be used:
+    titles without extracts are better than nothing.
+
+    """
+    missing = []
+    for page in pages:
+        cached = wf.cached_data('extract-{0}'.format(page['pageid']),
+                                max_age=0)
+        if cached is not None and cached[0] == page.get('lastrevid'):
+            page['extract'] = cached[1]
+        else:
+            missing.append(page)
+    if not missing:
+        return(True)
+
+    extract_params = dict(EXTRACT_PARAMS, pageids='|'.join(
+        str(page['pageid']) for page in missing))
+    try:
+        data = json.loads(request_api(wf, extract_params, generation,
+                                      'extracts'))
+    except (DeadlineExceeded, CircuitOpen, RateLimited,
+            requests.exceptions.RequestException) as err:
+        wf.logger.warning('Extracts not fetched : %s', err)
+        return(False)
+    extracts = dict((page['pageid'], page.get('extract', ''))
+                    for page in data['query']['pages'])
+    for page in missing:
+        if page['pageid'] not in extracts:
+            continue
+        page['extract'] = extracts[page['pageid']]
+        wf.cache_data('extract-{0}'.format(page['pageid']),
+                      (page.get('lastrevid'), page['extract']))
+    return(True)
+
+def get_negative_filter(wf):
+    """Return the `BloomFilter` of queries known to have no results.
+
+    """
+    return(BloomFilter(wf.cachefile('negative.bloom'),
+                       max_age=NEGATIVE_TTL))
+
+def is_known_empty(wf, key):
+    """Whether `key` was recently remembered with `remember_empty`.
+
+    The Bloom filter answers most lookups without loading the list of
+    empty queries, which is then checked to rule out false positives.
+
+    """
+    if key not in get_negative_filter(wf):
+        return(False)
+    remembered = wf.cached_data('negative', max_age=0) or {}
+    return(time.time() - remembered.get(key, 0) < NEGATIVE_TTL)
+
+def remember_empty(wf, key):
+    """Remember that `key` has no results for `NEGATIVE_TTL` seconds.
+
+    Keys are `empty:<query>` for queries without any results and
+    `noprefix:<query>` for queries no title starts with.
+
+    """
+    get_negative_filter(wf).add(key)
+    with LockFile(wf.cachefile('negative')):
+        now = time.time()
+        remembered = wf.cached_data('negative', max_age=0) or {}
+        remembered = dict((k, t) for k, t in remembered.items()
+                          if now - t < NEGATIVE_TTL)
+        remembered[key] = now
+        if len(remembered) > NEGATIVE_MAX_ENTRIES:
+            keep = sorted(remembered, key=remembered.get,
+                          reverse=True)[:NEGATIVE_MAX_ENTRIES]
+            remembered = dict((k, remembered[k]) for k in keep)
+        wf.cache_data('negative', remembered)
+
+def no_title_prefix(wf, query):
+    """Whether no title starts with `query` or with the start of it.
 
     """
-    # Wikipedia search parameters
-    search_params = {
-        'action': 'query',
-        'gsrsearch': query,
-        'format': 'json',
-        'prop': 'extracts',
-        'generator': 'search',
-        'gsrnamespace': '0',
-        'gsrlimit': 10,
-        'redirects': 1,
-        'explaintext': '',
-        'exsentences': 5,
-        'exintro': 2,
-        'exlimit': 'max',
-        'excontinue': 1
-    }
+    key = normalize_query(wf, query)
+    return(any(is_known_empty(wf, 'noprefix:' + key[:i])
+               for i in range(1, len(key) + 1)))
+
+def record_lookup(wf, query, cached_query, hit):
+    """Add a cache lookup for `query` to the metrics.
+
+    `cached_query` is the spelling the cached results were fetched for.
+    A hit for a different spelling is one that only canonicalization
+    made possible, but only the first time that spelling is looked up:
+    without canonicalization, it would be cached after that miss.
+
+    """
+    seen = BloomFilter(wf.cachefile('spellings.bloom'),
+                       max_age=CACHE_MAX_AGE)
+    first = query not in seen
+    if first:
+        seen.add(query)
+
+    def update(metrics):
+        stats = metrics.setdefault('cache', {'lookups': 0, 'hits': 0,
+                                             'canonical_hits': 0})
+        stats['lookups'] += 1
+        if hit:
+            stats['hits'] += 1
+            if first and cached_query not in (None, query):
+                stats['canonical_hits'] += 1
+    update_metrics(wf, update)
+
+def show_metrics(wf):
+    """Print the metrics, with the cache hit rate with and without
+    canonicalization and the health of endpoints.
+
+    """
+    metrics = get_metrics(wf)
+    metrics['endpoints'] = get_breaker(wf).health()
+    stats = metrics.get('cache')
+    if stats and stats['lookups']:
+        stats['hit_rate'] = float(stats['hits']) / stats['lookups']
+        stats['raw_hit_rate'] = (float(stats['hits'] -
+                                       stats['canonical_hits']) /
+                                 stats['lookups'])
+    print(json.dumps(metrics, indent=2, sort_keys=True))
+
+def get_metrics(wf):
+    """Return metrics shared by all runs.
+
+    """
+    return(wf.cached_data('metrics', max_age=0) or {})
+
+def update_metrics(wf, func):
+    """Call `func` with the metrics and save them.
+
+    """
+    with LockFile(wf.cachefile('metrics')):
+        metrics = get_metrics(wf)
+        func(metrics)
+        wf.cache_data('metrics', metrics)
+
+def choose_strategy(wf, query):
+    """Return the name of the strategy in `STRATEGIES` to search
+    for `query` with.
+
+    Short queries go to whichever strategy has been fastest so far
+    (untried ones first), except that now and again another one is
+    tried so its latency stays up to date. Longer queries, and ones
+    that extend a query no title starts with, always use full-text
+    search.
+
+    """
+    if len(query) > PREFIX_MAX_CHARS or no_title_prefix(wf, query):
+        return('fulltext')
+    if random.random() < EXPLORE_RATE:
+        return(random.choice(list(STRATEGIES)))
+    stats = get_metrics(wf).get('strategies', {})
+    return(min(STRATEGIES,
+               key=lambda name: stats.get(name, {}).get('latency', 0)))
+
+def record_strategy(wf, strategy, elapsed, failed=False):
+    """Add a search with `strategy` that took `elapsed` seconds to
+    the metrics.
+
+    """
+    def update(metrics):
+        stats = metrics.setdefault('strategies', {}).setdefault(
+            strategy, {'count': 0, 'errors': 0, 'latency': elapsed})
+        stats['count'] += 1
+        if failed:
+            stats['errors'] += 1
+        stats['latency'] += LATENCY_WEIGHT * (elapsed - stats['latency'])
+    update_metrics(wf, update)
+
+def search_titles(wf, query, strategy, generation=None, cont=None):
+    """Return the pages matching `query`, found with `strategy`, and
+    the API's `continue` parameters for the next page (or `None`).
+
+    `cont` is the `continue` parameters of the previous page.
+
+    """
+    key, params = STRATEGIES[strategy]
+    search_params = dict(params, **{key: query})
+    search_params.update(cont or {})
 
     # Request results in JSON
-    r = requests.get(API_URL, params=search_params)
-    r.raise_for_status()
-    data = json.loads(r.content)
+    start = time.time()
+    try:
+        data = json.loads(request_api(wf, search_params, generation,
+                                      'titles'))
+    except (Superseded, CircuitOpen, RateLimited):
+        raise
+    except Exception:
+        record_strategy(wf, strategy, time.time() - start, failed=True)
+        raise
+    record_strategy(wf, strategy, time.time() - start)
     if debug == 2:
         print(type(data))
         pprint(data)
 
+    # No `query` key means no results
+    return(data.get('query', {}).get('pages', []), data.get('continue'))
+
+def fetch_results(wf, query, generation=None, after=None):
+    """Fetch results for `query` from Wikipedia and parse them.
+
+    If `generation` is given, stop as soon as a newer search starts.
+    `after` is the `after` of the previous page's results to fetch the
+    next page.
+
+    Return the results in the form they are cached (`pack_results`).
+    If extracts had to be left out, raise `Incomplete` with the results
+    instead.
+
+    """
+    if after is not None:
+        strategy = after['strategy']
+        results, cont = search_titles(wf, query, strategy, generation,
+                                      after['continue'])
+    else:
+        strategy = choose_strategy(wf, query)
+        results, cont = search_titles(wf, query, strategy, generation)
+        # No title starts with the query, but it may be in some text
+        if not results and strategy != 'fulltext':
+            remember_empty(wf, 'noprefix:' + normalize_query(wf, query))
+            strategy = 'fulltext'
+            results, cont = search_titles(wf, query, strategy, generation)
+        if not results:
+            remember_empty(wf, 'empty:' + normalize_query(wf, query))
+
     # Get only the results we want
-    results = data['query']['pages']
-    items = parse_results(results)
+    complete = add_extracts(wf, results, generation)
+    items = parse_results(results, generation)
     if debug == 3:
         print(type(results))
         pprint(results)
         pprint(items)
-    wf.cache_data('results', items)
-    prepare_feedback(wf, items)
+    if cont:
+        after = {'strategy': strategy, 'continue': cont}
+    else:
+        after = None
+    results = pack_results(query, items, after)
+    if not complete:
+        raise Incomplete(results)
+    return(results)
+
+def load_page(wf, hot, query, page, generation=None, metrics=False):
+    """Return cached results for page `page` of `query`, fetching them
+    (and any pages before them) if necessary.
+
+    Return `None` if there is no such page. If `metrics` is set, the
+    lookup is added to the metrics.
+
+    Results lacking extracts (see `fetch_results`) are returned, but
+    only cached apart from complete ones. If Wikipedia doesn't answer
+    in time, results cached earlier are returned however old they are
+    (complete ones if possible), marked `stale`.
+
+    """
+    name = page_cache_name(wf, query, page)
+    results = hot.get(name, max_age=CACHE_MAX_AGE)
+    if results is not None:
+        if metrics:
+            record_lookup(wf, query, unpack_results(results)[0], hit=True)
+        return(results)
+
+    after = None
+    if page:
+        previous = load_page(wf, hot, query, page - 1, generation)
+        if previous is None:
+            return(None)
+        after = unpack_results(previous)[2]
+        if after is None:
+            return(None)
+
+    fetched = []
+
+    def fetch():
+        fetched.append(True)
+        return(fetch_results(wf, query, generation, after))
+
+    try:
+        results = wf.cached_data_coalesced(
+            name,
+            fetch,
+            max_age=CACHE_MAX_AGE,
+            timeout=stage_timeout(generation, 'titles', COALESCE_TIMEOUT))
+    except Incomplete as err:
+        # The next search tries to get the extracts again
+        results = err.results
+        wf.cache_data(name + '-partial', results)
+    except (DeadlineExceeded, CircuitOpen, RateLimited,
+            requests.exceptions.RequestException) as err:
+        results = (wf.cached_data(name, max_age=0) or
+                   wf.cached_data(name + '-partial', max_age=0))
+        if results is None:
+            raise
+        wf.logger.warning('Using stale results for `%s` : %s', query, err)
+        return(dict(pack_results(*unpack_results(results)), stale=True))
+    else:
+        hot.set(name, results)
+    if metrics:
+        record_lookup(wf, query, unpack_results(results)[0],
+                      hit=not fetched)
+    return(results)
+
+def search(wf, query):
+    """Search Wikipedia for `query`.
+
+    Alfred may run several copies of this script for the same query
+    at once, so only one of them fetches the results and the others
+    wait for it to cache them. If the user types on and a newer search
+    starts, this one gives up without sending any results.
+
+    Recent results are also kept in a memory-mapped hot cache shared
+    by all runs, which is checked before the on-disk cache.
+
+    Queries that recently had no results are answered at once.
+
+    A query ending in `MORE_MARKER`s shows that many more pages of
+    results. The last item autocompletes the query to show the next
+    page, which is fetched in the background while the user looks at
+    this one (for the first page, only if prefetching is turned on).
+    The query and page are also set as workflow variables.
+
+    The search has a time budget (`get_time_budget`). If Wikipedia
+    doesn't answer within it, has been failing lately (see `request`)
+    or the rate limit is reached (see `request_api`), older cached
+    results are shown with a warning, or, if there are none, a link to
+    search the website.
+
+    Return the results sent to Alfred, or `None` if superseded.
+
+    """
+    query, page = parse_page(query)
+    wf.setvar('query', query)
+    wf.setvar('page', str(page))
+    if is_known_empty(wf, 'empty:' + normalize_query(wf, query)):
+        prepare_feedback(wf, [])
+        return([])
+
+    hot = HotCache(wf.cachefile('results.hotcache'))
+    generation = Generation(wf, query, Deadline(get_time_budget(wf)))
+    items = []
+    after = None
+    stale = False
+    try:
+        for number in range(page + 1):
+            results = load_page(wf, hot, query, number, generation,
+                                metrics=(number == page))
+            if results is None:
+                break
+            items.extend(unpack_results(results)[1])
+            after = unpack_results(results)[2]
+            if isinstance(results, dict) and results.get('stale'):
+                stale = True
+    except Superseded:
+        wf.logger.debug('Search for `%s` superseded', query)
+        return(None)
+    except (DeadlineExceeded, CircuitOpen, RateLimited,
+            requests.exceptions.RequestException) as err:
+        wf.logger.warning('Search for `%s` failed : %s', query, err)
+        if not items:
+            prepare_offline_feedback(wf, query)
+            return([])
+        results = None
+        stale = True
+
+    more = None
+    if results is not None and after is not None:
+        more = '{0} {1}'.format(query, MORE_MARKER * (page + 1))
+        if page or prefetch_enabled():
+            schedule_next_page(wf, query, page + 1)
+    prepare_feedback(wf, items, more, stale)
+    return(items)
+
+def get_cache_manager(wf):
+    """Return a `CacheManager` that keeps the cache within budget.
+
+    """
+    return(CacheManager(wf, max_bytes=CACHE_MAX_BYTES,
+                        max_entries=CACHE_MAX_ENTRIES,
+                        ttls={'search-*': CACHE_TTL,
+                              'extract-*': EXTRACT_TTL}))
+
+def schedule_cache_sweep(wf):
+    """Sweep the cache in the background if it's due.
+
+    """
+    if get_cache_manager(wf).due:
+        run_in_background('cache-sweep',
+                          [sys.executable, wf.workflowfile('search.py'),
+                           '--sweep-cache'])
+
+def get_query_log(wf):
+    """Return the `QueryLog` searches are recorded in.
+
+    """
+    return(QueryLog(wf))
+
+def warm_cache(wf):
+    """Refresh cached results of the most frequent queries before
+    they expire, so they are answered from the cache.
+
+    Queries are logged normalized, but sent to the API as last typed.
+
+    """
+    hot = HotCache(wf.cachefile('results.hotcache'))
+    log = get_query_log(wf)
+    keys = log.top(WARM_QUERIES)
+    texts = log.texts()
+    for key in keys:
+        query = texts.get(key, key)
+        name = cache_name(wf, query)
+        if wf.cached_data_fresh(name, CACHE_MAX_AGE - WARM_INTERVAL):
+            continue
+        try:
+            results = fetch_results(wf, query)
+        except Exception as err:
+            wf.logger.error('Could not refresh `%s` : %s', query, err)
+            continue
+        wf.cache_data(name, results)
+        hot.set(name, results)
+
+def schedule_cache_warming(wf):
+    """Refresh popular queries every `WARM_INTERVAL` seconds.
+
+    """
+    schedule('warm-cache',
+             [sys.executable, wf.workflowfile('search.py'), '--warm-cache'],
+             interval=WARM_INTERVAL)
+
+def prefetch_enabled():
+    """Whether the user has turned on speculative prefetching by
+    setting the `prefetch` workflow variable.
+
+    """
+    return(env_flag('prefetch'))
+
+def predict_queries(wf, query, items):
+    """Guess which queries are likely to follow `query`.
+
+    Candidates are the titles of `items` (the results for `query`) and
+    earlier queries that extend `query`. Titles are ranked by their
+    position in the results, earlier queries by how often they were
+    searched. Queries whose results are already cached are skipped.
+
+    Candidates are compared normalized, but returned as they are to be
+    sent to the API: titles as they are, earlier queries as last typed.
+
+    """
+    query = normalize_query(wf, query)
+    log = get_query_log(wf)
+    scores = {}
+    texts = {}
+    for rank, item in enumerate(items):
+        title = normalize_query(wf, item['title'])
+        if title != query and title.startswith(query):
+            scores[title] = scores.get(title, 0) + 1.0 / (rank + 1)
+            texts.setdefault(title, item['title'])
+    past_texts = log.texts()
+    for past, score in log.scores().items():
+        if past != query and past.startswith(query):
+            scores[past] = scores.get(past, 0) + score
+            texts.setdefault(past, past_texts.get(past, past))
+    ranked = sorted(scores, key=lambda q: scores[q], reverse=True)
+    ranked = [q for q in ranked
+              if not wf.cached_data_fresh(cache_name(wf, q), CACHE_MAX_AGE)]
+    return([texts[q] for q in ranked[:PREFETCH_COUNT]])
+
+def schedule_prefetch(wf, query, items):
+    """Fetch results for likely next queries in the background.
+
+    Only one prefetch task runs at a time: if one is still running,
+    these predictions are dropped.
+
+    """
+    queries = predict_queries(wf, query, items)
+    if queries:
+        run_in_background('prefetch',
+                          [sys.executable, wf.workflowfile('search.py'),
+                           '--prefetch'] +
+                          [q.encode('utf-8') for q in queries])
+
+def take_prefetch_slot(wf):
+    """Count a prefetch request against the rate limit.
+
+    Return `False` if `PREFETCH_RATE` requests have already been made
+    in the last `PREFETCH_PERIOD` seconds. The 'prefetch' and
+    'next-page' tasks may run at once, so they share the count.
+
+    """
+    with LockFile(wf.cachefile('prefetch-times')):
+        now = time.time()
+        times = wf.cached_data('prefetch-times', max_age=0) or []
+        recent = [t for t in times if t > now - PREFETCH_PERIOD]
+        if len(recent) >= PREFETCH_RATE:
+            wf.logger.debug('Prefetch rate limit reached')
+            return(False)
+        wf.cache_data('prefetch-times', recent + [now])
+        return(True)
+
+def prefetch(wf, queries):
+    """Fetch and cache results for `queries`.
+
+    Runs at low priority, makes at most `PREFETCH_RATE` requests per
+    `PREFETCH_PERIOD` seconds and stops as soon as a search starts.
+
+    """
+    os.nice(10)
+    hot = HotCache(wf.cachefile('results.hotcache'))
+    foreground = Foreground(wf)
+    for query in queries:
+        name = cache_name(wf, query)
+        if wf.cached_data_fresh(name, CACHE_MAX_AGE):
+            continue
+        if not take_prefetch_slot(wf):
+            return
+        try:
+            results = wf.cached_data_coalesced(
+                name,
+                lambda: fetch_results(wf, query, foreground),
+                max_age=CACHE_MAX_AGE,
+                timeout=COALESCE_TIMEOUT)
+        except Superseded:
+            wf.logger.debug('Prefetch stopped by search')
+            return
+        except Incomplete:
+            wf.logger.debug('Extracts for `%s` not fetched', query)
+            continue
+        except Exception as err:
+            wf.logger.error('Could not prefetch `%s` : %s', query, err)
+            continue
+        hot.set(name, results)
+        wf.logger.debug('Prefetched `%s`', query)
+
+def schedule_next_page(wf, query, page):
+    """Fetch page `page` of results for `query` in the background.
+
+    """
+    if wf.cached_data_fresh(page_cache_name(wf, query, page),
+                            CACHE_MAX_AGE):
+        return
+    run_in_background('next-page',
+                      [sys.executable, wf.workflowfile('search.py'),
+                       '--next-page', str(page), query.encode('utf-8')])
+
+def prefetch_page(wf, query, page):
+    """Fetch and cache page `page` of results for `query`.
+
+    Runs at low priority, counts against the prefetch rate limit and
+    stops as soon as a search starts.
+
+    """
+    os.nice(10)
+    if not take_prefetch_slot(wf):
+        return
+    hot = HotCache(wf.cachefile('results.hotcache'))
+    try:
+        load_page(wf, hot, query, page, Foreground(wf))
+    except Superseded:
+        wf.logger.debug('Next page prefetch stopped by search')
+    except Exception as err:
+        wf.logger.error('Could not prefetch page %d of `%s` : %s',
+                        page, query, err)
+
+def schedule_quicklook(wf, items):
+    """Download the mobile pages of the top results in the background.
+
+    """
+    titles = [item['title'] for item in items[:QUICKLOOK_COUNT]
+              if not quicklook_cached(wf, item['title'])]
+    if titles:
+        run_in_background('quicklook',
+                          [sys.executable, wf.workflowfile('search.py'),
+                           '--quicklook'] +
+                          [t.encode('utf-8') for t in titles])
+
+def fetch_quicklook(wf, titles):
+    """Save the mobile pages for `titles` for Quick Look.
+
+    A `<base>` tag is added to each page, so its stylesheets, images
+    and links still work when it is opened from disk. Only the
+    `QUICKLOOK_MAX_PAGES` most recent pages are kept. Stops as soon
+    as a search starts.
+
+    """
+    os.nice(10)
+    dirpath = wf.cachefile('quicklook')
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    foreground = Foreground(wf)
+    for title in titles:
+        if quicklook_cached(wf, title):
+            continue
+        try:
+            html = request(wf, MOBILE_URL, get_quicklook_url(title),
+                           generation=foreground)
+        except Superseded:
+            wf.logger.debug('Quick Look prefetch stopped by search')
+            break
+        except Exception as err:
+            wf.logger.error('Could not fetch page `%s` : %s', title, err)
+            continue
+        base = '<base href="{0}">'.format(MOBILE_URL).encode('utf-8')
+        html = re.sub(br'(?i)(<head[^>]*>)', lambda m: m.group(1) + base,
+                      html, count=1)
+        with atomic_writer(get_quicklook_path(wf, title), 'wb') as file_obj:
+            file_obj.write(html)
+        wf.logger.debug('Saved page `%s` for Quick Look', title)
+
+    # Keep the newest pages
+    pages = [os.path.join(dirpath, name) for name in os.listdir(dirpath)
+             if name.endswith('.html')]
+    pages.sort(key=os.path.getmtime, reverse=True)
+    for path in pages[QUICKLOOK_MAX_PAGES:]:
+        os.unlink(path)
+
+def get_probe_url(endpoint):
+    """Return a cheap URL to check that `endpoint` works.
+
+    """
+    if endpoint == MOBILE_URL:
+        return(MOBILE_URL + 'Special:BlankPage')
+    return(endpoint + '?action=query&meta=siteinfo&format=json')
+
+def schedule_probes(wf):
+    """Probe endpoints whose circuit is half-open in the background.
+
+    """
+    run_in_background('probe',
+                      [sys.executable, wf.workflowfile('search.py'),
+                       '--probe'])
+
+def probe_endpoints(wf):
+    """Make one request to each endpoint whose circuit is half-open,
+    which closes the circuit if it succeeds.
+
+    """
+    breaker = get_breaker(wf)
+    for endpoint in breaker.probes_due():
+        start = time.time()
+        try:
+            r = requests.get(get_probe_url(endpoint), headers=HEADERS,
+                             timeout=PROBE_TIMEOUT)
+            r.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            wf.logger.warning('Probe of %s failed : %s', endpoint, err)
+            breaker.record(endpoint, time.time() - start, ok=False,
+                           probe=True)
+            continue
+        breaker.record(endpoint, time.time() - start, probe=True)
+
+def get_responses_dir(wf):
+    """Return the directory responses are recorded in.
+
+    """
+    dirpath = wf.datafile('responses')
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    return(dirpath)
+
+def record_responses(wf, queries):
+    """Save the API's responses to `queries` with each of `PROFILES`,
+    for `benchmark_profiles`.
+
+    """
+    dirpath = get_responses_dir(wf)
+    for query in queries:
+        key = hashlib.md5(query.encode('utf-8')).hexdigest()
+        for profile, params in PROFILES.items():
+            r = requests.get(API_URL, params=dict(params, gsrsearch=query),
+                             headers=HEADERS, timeout=REQUEST_TIMEOUT)
+            r.raise_for_status()
+            path = os.path.join(dirpath, '{0}-{1}.json'.format(profile, key))
+            with atomic_writer(path, 'wb') as file_obj:
+                file_obj.write(r.content)
+
+def benchmark_profiles(wf, repeat=20):
+    """Compare payload size and parse time of the responses recorded
+    with each of `PROFILES`.
+
+    """
+    dirpath = get_responses_dir(wf)
+    for profile in PROFILES:
+        payloads = []
+        for filename in sorted(os.listdir(dirpath)):
+            if filename.startswith(profile + '-'):
+                with open(os.path.join(dirpath, filename), 'rb') as file_obj:
+                    payloads.append(file_obj.read())
+        if not payloads:
+            print('{0}: no recorded responses'.format(profile))
+            continue
+        start = time.time()
+        for i in range(repeat):
+            for payload in payloads:
+                parse_results(json.loads(payload)['query']['pages'])
+        elapsed = (time.time() - start) / (repeat * len(payloads))
+        size = sum(len(payload) for payload in payloads) // len(payloads)
+        print('{0:8s} {1:4d} responses {2:8d} bytes/response '
+              '{3:8.3f} ms/parse'.format(profile, len(payloads), size,
+                                         elapsed * 1000))
 
 def main(wf):
-    return(search(wf, wf.args[0]))
+    if wf.args[0] == '--sweep-cache':
+        return(get_cache_manager(wf).sweep())
+    if wf.args[0] == '--warm-cache':
+        return(warm_cache(wf))
+    if wf.args[0] == '--prefetch':
+        return(prefetch(wf, wf.args[1:]))
+    if wf.args[0] == '--next-page':
+        return(prefetch_page(wf, wf.args[2], int(wf.args[1])))
+    if wf.args[0] == '--probe':
+        return(probe_endpoints(wf))
+    if wf.args[0] == '--quicklook':
+        return(fetch_quicklook(wf, wf.args[1:]))
+    if wf.args[0] == '--record-responses':
+        return(record_responses(wf, wf.args[1:]))
+    if wf.args[0] == '--benchmark':
+        return(benchmark_profiles(wf))
+    if wf.args[0] == '--metrics':
+        return(show_metrics(wf))
+    items = search(wf, wf.args[0])
+    query = parse_page(wf.args[0])[0]
+    get_query_log(wf).record(normalize_query(wf, query), text=query)
+    if items:
+        schedule_quicklook(wf, items)
+    if items and prefetch_enabled():
+        schedule_prefetch(wf, query, items)
+    schedule_cache_sweep(wf)
+    schedule_cache_warming(wf)
+    run_scheduled()
 
 if __name__ == '__main__':
     wf = Workflow3()
@@ -8,7 +8,34 @@
 # Created on 2014-04-06
 #
 
-"""Run background tasks."""
+"""Run background tasks.
+
+Tasks are queued as files in a directory in the workflow's cache
+directory and run by a supervisor process, which is started on demand
+and keeps running (and picking up new tasks) until it has been idle
+for :const:`IDLE_TIMEOUT` seconds. So only the first task of a burst
+has to wait for a Python interpreter to start.
+
+Tasks can report their progress with :func:`set_progress` and hand a
+return value back to the foreground with :func:`set_result`. A Script
+Filter can poll both with :func:`progress` and :func:`result`, using
+:attr:`Workflow3.rerun <workflow.workflow3.Workflow3.rerun>` to get
+Alfred to run it again until the task has finished::
+
+    data = result('fetch', max_age=600)
+    if data is None:
+        if not is_running('fetch'):
+            run_in_background('fetch', ['/usr/bin/python', 'fetch.py'])
+        state = progress('fetch') or {}
+        wf.add_item('Fetching...', state.get('message'))
+        wf.rerun = 0.5
+
+Commands can also be run periodically with :func:`schedule`. Jobs are
+saved in the workflow's data directory and started by
+:func:`run_scheduled`, which the supervisor calls while it's running
+and a workflow can call on every run.
+
+"""
 
 from __future__ import print_function, unicode_literals
 
@@ -16,10 +43,35 @@ import sys
 import os
 import subprocess
 import pickle
+import random
+import time
 
 from workflow import Workflow
 
-__all__ = ['is_running', 'run_in_background']
+try:
+    from workflow.workflow import LockFile, atomic_writer
+except ImportError:  # pragma: no cover  (run as a script)
+    from workflow import LockFile, atomic_writer
+
+__all__ = ['is_running', 'run_in_background', 'progress', 'result',
+           'set_progress', 'set_result', 'task_name', 'schedule',
+           'unschedule', 'run_scheduled']
+
+#: Maximum number of tasks the supervisor runs at the same time
+MAX_WORKERS = 4
+#: Seconds between checks of the task queue
+POLL_INTERVAL = 0.1
+#: Seconds without tasks after which the supervisor exits
+IDLE_TIMEOUT = 60
+#: Seconds between checks for due scheduled jobs by the supervisor
+SCHEDULE_INTERVAL = 10
+
+# Name the supervisor's PID file is saved under
+_SUPERVISOR = '.supervisor'
+# Environment variable that tells a task its name
+_TASK_ENV = 'alfred_workflow_background_task'
+# Name scheduled jobs are stored under
+_SCHEDULE = 'background-schedule'
 
 _wf = None
 
@@ -31,16 +83,32 @@ def wf():
     return _wf
 
 
-def _arg_cache(name):
-    """Return path to pickle cache file for arguments.
+def _queue_dir():
+    """Return path to directory tasks are queued in.
+
+    :returns: Path to queue directory
+    :rtype: ``unicode`` filepath
+
+    """
+    dirpath = wf().cachefile('background-queue')
+    if not os.path.exists(dirpath):
+        try:
+            os.makedirs(dirpath)
+        except OSError:  # created by another process
+            pass
+    return dirpath
+
+
+def _task_file(name):
+    """Return path to queue file for task ``name``.
 
     :param name: name of task
     :type name: ``unicode``
-    :returns: Path to cache file
+    :returns: Path to queue file
     :rtype: ``unicode`` filepath
 
     """
-    return wf().cachefile('{0}.argcache'.format(name))
+    return os.path.join(_queue_dir(), '{0}.task'.format(name))
 
 
 def _pid_file(name):
@@ -72,7 +140,7 @@ def _process_exists(pid):
 
 
 def is_running(name):
-    """Test whether task is running under ``name``.
+    """Test whether task is running (or queued to run) under ``name``.
 
     :param name: name of task
     :type name: ``unicode``
@@ -80,6 +148,9 @@ def is_running(name):
     :rtype: ``Boolean``
 
     """
+    if os.path.exists(_task_file(name)):
+        return True
+
     pidfile = _pid_file(name)
     if not os.path.exists(pidfile):
         return False
@@ -96,6 +167,90 @@ def is_running(name):
     return False
 
 
+def task_name():
+    """Return name of the background task the current process is running.
+
+    :returns: name of task or ``None`` if not run by :func:`run_in_background`
+    :rtype: ``unicode`` or ``None``
+
+    """
+    name = os.getenv(_TASK_ENV)
+    if not name:
+        return None
+    return wf().decode(name)
+
+
+def _task_cache_name(kind, name):
+    """Return name progress or result of task ``name`` is cached under."""
+    if name is None:
+        name = task_name()
+    if name is None:
+        raise ValueError('Not running as a background task: pass `name`')
+    return 'background-{0}-{1}'.format(kind, name)
+
+
+def set_progress(percent=None, message=None, name=None):
+    """Publish progress of a background task.
+
+    :param percent: how much of the task is done (0-100)
+    :type percent: ``int`` or ``float``
+    :param message: description of what the task is doing
+    :type message: ``unicode``
+    :param name: name of task. Defaults to :func:`task_name`.
+    :type name: ``unicode``
+
+    """
+    wf().cache_data(_task_cache_name('progress', name),
+                    {'percent': percent, 'message': message,
+                     'retcode': None, 'updated': time.time()})
+
+
+def progress(name):
+    """Return the last progress published by task ``name``.
+
+    :param name: name of task
+    :type name: ``unicode``
+    :returns: ``dict`` with the keys ``percent``, ``message``,
+        ``updated`` (a timestamp) and ``retcode``, which is the task's
+        exit status once it has finished and ``None`` before. ``None``
+        if the task hasn't reported any progress since it was queued.
+    :rtype: ``dict`` or ``None``
+
+    """
+    return wf().cached_data(_task_cache_name('progress', name), max_age=0)
+
+
+def set_result(data, name=None):
+    """Hand the return value of a background task to the foreground.
+
+    :param data: data to save. Must be serializable by the workflow's
+        :attr:`~workflow.workflow.Workflow.cache_serializer`.
+        ``None`` deletes the saved result.
+    :param name: name of task. Defaults to :func:`task_name`.
+    :type name: ``unicode``
+
+    """
+    wf().cache_data(_task_cache_name('result', name), data)
+
+
+def result(name, max_age=0):
+    """Return the result saved by task ``name``.
+
+    The result of a task's previous run remains available while it is
+    queued or running again, so use ``max_age`` to ignore old results.
+
+    :param name: name of task
+    :type name: ``unicode``
+    :param max_age: maximum age of result in seconds. If 0, the result
+        is returned no matter how old.
+    :type max_age: ``int``
+    :returns: saved data or ``None`` if there is none
+
+    """
+    return wf().cached_data(_task_cache_name('result', name),
+                            max_age=max_age)
+
+
 def _background(stdin='/dev/null', stdout='/dev/null',
                 stderr='/dev/null'):  # pragma: no cover
     """Fork the current process into a background daemon.
@@ -143,101 +298,312 @@ def _background(stdin='/dev/null', stdout='/dev/null',
         os.dup2(se.fileno(), sys.stderr.fileno())
 
 
+def _start_supervisor():
+    """Start supervisor process unless it's already running.
+
+    :returns: exit code of process that starts the supervisor
+    :rtype: ``int``
+
+    """
+    if is_running(_SUPERVISOR):
+        return 0
+
+    cmd = ['/usr/bin/python', __file__]
+    wf().logger.debug('Calling {0!r} ...'.format(cmd))
+    retcode = subprocess.call(cmd)
+    if retcode:  # pragma: no cover
+        wf().logger.error('Failed to start background supervisor')
+    return retcode
+
+
 def run_in_background(name, args, **kwargs):
-    r"""Cache arguments then call this script again via :func:`subprocess.call`.
+    r"""Queue a command to be run in the background.
 
     :param name: name of task
     :type name: ``unicode``
-    :param args: arguments passed as first argument to :func:`subprocess.call`
-    :param \**kwargs: keyword arguments to :func:`subprocess.call`
-    :returns: exit code of sub-process
+    :param args: arguments passed as first argument to
+        :class:`subprocess.Popen`
+    :param \**kwargs: keyword arguments to :class:`subprocess.Popen`
+    :returns: exit code of process that started the supervisor (``0`` if
+        it was already running)
     :rtype: ``int``
 
-    When you call this function, it caches its arguments and then calls
-    ``background.py`` in a subprocess. The Python subprocess will load the
-    cached arguments, fork into the background, and then run the command you
-    specified.
+    When you call this function, it saves the command to the task queue
+    and, if it isn't already running, starts the supervisor process
+    that runs queued tasks. The supervisor runs up to
+    :const:`MAX_WORKERS` tasks at once.
 
-    This function will return as soon as the ``background.py`` subprocess has
-    forked, returning the exit code of *that* process (i.e. not of the command
-    you're trying to run).
+    This function returns as soon as the task is queued. If the
+    supervisor fails to start, an error will be written to the log file.
 
-    If that process fails, an error will be written to the log file.
+    If a task is already queued or running under the same name, this
+    function will not queue the specified command. It still starts the
+    supervisor if need be, in case the one that queued the task died.
 
-    If a process is already running under the same name, this function will
-    return immediately and will not run the specified command.
+    Unless ``env`` is passed, the command is run with the environment
+    of the process that called this function (not the supervisor's),
+    plus the task's name, so it can call :func:`set_progress` and
+    :func:`set_result` without passing ``name``.
 
     """
     if is_running(name):
         wf().logger.info('Task `{0}` is already running'.format(name))
-        return
+        return _start_supervisor()
 
-    argcache = _arg_cache(name)
+    taskfile = _task_file(name)
+    # The supervisor may have been started by another process, with
+    # other workflow variables
+    if kwargs.get('env') is None:
+        kwargs['env'] = dict(os.environ)
 
-    # Cache arguments
-    with open(argcache, 'wb') as file_obj:
+    with atomic_writer(taskfile, 'wb') as file_obj:
         pickle.dump({'args': args, 'kwargs': kwargs}, file_obj)
-        wf().logger.debug('Command arguments cached to `{0}`'.format(argcache))
+    # Progress of the previous run is meaningless now
+    wf().cache_data(_task_cache_name('progress', name), None)
+    wf().logger.debug('Task `{0}` queued at `{1}`'.format(name, taskfile))
 
-    # Call this script
-    cmd = ['/usr/bin/python', __file__, name]
-    wf().logger.debug('Calling {0!r} ...'.format(cmd))
-    retcode = subprocess.call(cmd)
-    if retcode:  # pragma: no cover
-        wf().logger.error('Failed to call task in background')
-    else:
-        wf().logger.debug('Executing task `{0}` in background...'.format(name))
-    return retcode
+    return _start_supervisor()
 
 
-def main(wf):  # pragma: no cover
-    """Run command in a background process.
+def schedule(name, args, interval, jitter=0.1, **kwargs):
+    r"""Run a command in the background every ``interval`` seconds.
 
-    Load cached arguments, fork into background, then call
-    :meth:`subprocess.call` with cached arguments.
+    The job is saved in the workflow's data directory and run by
+    :func:`run_in_background` when :func:`run_scheduled` finds it due,
+    so it only runs while the workflow (or the supervisor) is in use.
+    A job that is still running when it's next due is not started again.
+
+    Scheduling an existing job again replaces it, but keeps when it is
+    next due unless ``interval`` has changed. New jobs are due at once.
+
+    :param name: name of job. Also used as the name of the task.
+    :type name: ``unicode``
+    :param args: arguments passed as first argument to
+        :class:`subprocess.Popen`
+    :param interval: seconds between runs
+    :type interval: ``int``
+    :param jitter: randomly vary each interval by up to this fraction,
+        so jobs scheduled together don't keep running together
+    :type jitter: ``float``
+    :param \**kwargs: keyword arguments to :class:`subprocess.Popen`
 
     """
-    name = wf.args[0]
-    argcache = _arg_cache(name)
-    if not os.path.exists(argcache):
-        wf.logger.critical('No arg cache found : {0!r}'.format(argcache))
-        return 1
+    with LockFile(wf().datafile(_SCHEDULE)):
+        jobs = wf().stored_data(_SCHEDULE) or {}
+        job = {'args': args, 'kwargs': kwargs, 'interval': interval,
+               'jitter': jitter, 'next_run': time.time()}
+        old = jobs.get(name)
+        if old is not None:
+            if old == dict(job, next_run=old['next_run']):
+                return
+            if old['interval'] == interval:
+                job['next_run'] = old['next_run']
+
+        jobs[name] = job
+        wf().store_data(_SCHEDULE, jobs)
+    wf().logger.debug('Scheduled job `{0}` every {1}s'.format(name, interval))
+
+
+def unschedule(name):
+    """Remove scheduled job ``name``.
+
+    :param name: name of job
+    :type name: ``unicode``
 
-    # Load cached arguments
-    with open(argcache, 'rb') as file_obj:
-        data = pickle.load(file_obj)
+    """
+    with LockFile(wf().datafile(_SCHEDULE)):
+        jobs = wf().stored_data(_SCHEDULE) or {}
+        if jobs.pop(name, None) is not None:
+            wf().store_data(_SCHEDULE, jobs)
 
-    # Cached arguments
-    args = data['args']
-    kwargs = data['kwargs']
 
-    # Delete argument cache file
-    os.unlink(argcache)
+def run_scheduled():
+    """Start scheduled jobs that are due.
 
-    pidfile = _pid_file(name)
+    Cheap enough to call on every run of a workflow. If another process
+    is already checking the schedule, returns immediately.
 
-    # Fork to background
-    _background()
+    :returns: names of jobs started
+    :rtype: ``list``
 
-    # Write PID to file
-    with open(pidfile, 'wb') as file_obj:
-        file_obj.write('{0}'.format(os.getpid()))
+    """
+    lock = LockFile(wf().datafile(_SCHEDULE))
+    if not lock.acquire(blocking=False):
+        return []
 
-    # Run the command
+    started = []
     try:
-        wf.logger.debug('Task `{0}` running'.format(name))
-        wf.logger.debug('cmd : {0!r}'.format(args))
+        jobs = wf().stored_data(_SCHEDULE) or {}
+        now = time.time()
+        for name, job in jobs.items():
+            if job['next_run'] > now or is_running(name):
+                continue
+
+            jitter = random.uniform(-job['jitter'], job['jitter'])
+            job['next_run'] = now + job['interval'] * (1 + jitter)
+            started.append(name)
+
+        if started:
+            wf().store_data(_SCHEDULE, jobs)
+    finally:
+        lock.release()
 
-        retcode = subprocess.call(args, **kwargs)
+    # Starting the supervisor may take a while, and `schedule()` must
+    # not wait for it
+    for name in started:
+        run_in_background(name, jobs[name]['args'], **jobs[name]['kwargs'])
+    if started:
+        wf().logger.debug('Started scheduled jobs : {0}'.format(
+                          ', '.join(started)))
 
-        if retcode:
-            wf.logger.error('Command failed with [{0}] : {1!r}'.format(
-                            retcode, args))
+    return started
 
-    finally:
-        if os.path.exists(pidfile):
-            os.unlink(pidfile)
-        wf.logger.debug('Task `{0}` finished'.format(name))
+
+class _Supervisor(object):
+    """Runs queued tasks in subprocesses.
+
+    :param max_workers: maximum number of tasks to run at once
+    :type max_workers: ``int``
+
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        # Name -> subprocess.Popen of running tasks
+        self.running = {}
+
+    def run(self):
+        """Run queued tasks until idle for :const:`IDLE_TIMEOUT` seconds."""
+        last_busy = time.time()
+        last_scheduled = 0
+        while True:
+            if time.time() - last_scheduled >= SCHEDULE_INTERVAL:
+                last_scheduled = time.time()
+                try:
+                    run_scheduled()
+                except Exception as err:
+                    wf().logger.exception(err)
+
+            self.reap()
+            queued = self.queued()
+            self.start(queued)
+
+            if self.running or queued:
+                last_busy = time.time()
+            elif time.time() - last_busy >= IDLE_TIMEOUT:
+                break
+
+            time.sleep(POLL_INTERVAL)
+
+    def queued(self):
+        """Return names of queued tasks, oldest first."""
+        tasks = []
+        for filename in os.listdir(_queue_dir()):
+            if not filename.endswith('.task'):
+                continue
+            try:
+                mtime = os.stat(os.path.join(_queue_dir(), filename)).st_mtime
+            except OSError:
+                continue
+            tasks.append((mtime, filename[:-len('.task')]))
+        return [name for _, name in sorted(tasks)]
+
+    def start(self, names):
+        """Start queued tasks ``names`` while below worker limit."""
+        for name in names:
+            if len(self.running) >= self.max_workers:
+                return
+            if name in self.running:
+                continue
+
+            taskfile = _task_file(name)
+            try:
+                with open(taskfile, 'rb') as file_obj:
+                    data = pickle.load(file_obj)
+                kwargs = data['kwargs']
+                kwargs['env'] = dict(kwargs.get('env') or os.environ)
+                kwargs['env'][str(_TASK_ENV)] = name.encode('utf-8')
+                proc = subprocess.Popen(data['args'], **kwargs)
+            except Exception as err:
+                wf().logger.error('Could not start task `{0}` : {1}'.format(
+                                  name, err))
+                os.unlink(taskfile)
+                continue
+
+            # Write PID file before removing task from queue, so
+            # `is_running()` is never wrongly `False`
+            with open(_pid_file(name), 'wb') as file_obj:
+                file_obj.write('{0}'.format(proc.pid))
+            os.unlink(taskfile)
+
+            self.running[name] = proc
+            wf().logger.debug('Task `{0}` running'.format(name))
+            wf().logger.debug('cmd : {0!r}'.format(data['args']))
+
+    def reap(self):
+        """Clean up after finished tasks."""
+        for name, proc in list(self.running.items()):
+            retcode = proc.poll()
+            if retcode is None:
+                continue
+
+            del self.running[name]
+            if retcode:
+                wf().logger.error('Task `{0}` failed with [{1}]'.format(
+                                  name, retcode))
+
+            # Let pollers know the task is done, even if it crashed
+            state = progress(name) or {'percent': None, 'message': None}
+            state.update({'retcode': retcode, 'updated': time.time()})
+            wf().cache_data(_task_cache_name('progress', name), state)
+
+            pidfile = _pid_file(name)
+            if os.path.exists(pidfile):
+                os.unlink(pidfile)
+            wf().logger.debug('Task `{0}` finished'.format(name))
+
+
+def main(wf):  # pragma: no cover
+    """Run the task supervisor in a background process.
+
+    Fork into background, then run queued tasks until there have been
+    none for a while. Exits immediately if another supervisor is
+    already running.
+
+    """
+    # Fork to background
+    _background()
+
+    # Only one supervisor at a time. The lock is taken after forking,
+    # as the exiting parents would otherwise release it.
+    lock = LockFile(_queue_dir())
+    pidfile = _pid_file(_SUPERVISOR)
+    supervisor = _Supervisor()
+    while True:
+        if not lock.acquire(blocking=False):
+            return
+
+        # Write PID to file
+        with open(pidfile, 'wb') as file_obj:
+            file_obj.write('{0}'.format(os.getpid()))
+
+        try:
+            wf.logger.debug('Background supervisor running')
+            supervisor.run()
+
+        finally:
+            if os.path.exists(pidfile):
+                os.unlink(pidfile)
+            lock.release()
+
+        # `run_in_background()` doesn't start a supervisor for a task
+        # it queued while the PID file still existed, so check for one
+        # now it's gone
+        if not supervisor.queued():
+            break
+        wf.logger.debug('Task queued while supervisor was exiting')
+
+    wf.logger.debug('Background supervisor finished')
 
 
 if __name__ == '__main__':  # pragma: no cover
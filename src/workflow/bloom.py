@@ -0,0 +1,143 @@
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""Compact, expiring set membership test saved to a file.
+
+A :class:`BloomFilter` answers "have I seen this key?" with either
+"definitely not" or "probably", using a fixed number of bits however
+many keys are added. That makes it a cheap first check before looking
+something up in a larger store.
+
+Keys can't be removed from a Bloom filter, so to let keys expire the
+file holds two filters: new keys are added to the current one, and
+every ``max_age / 2`` seconds the current filter becomes the previous
+one and the oldest is discarded. A key is thus remembered for between
+``max_age / 2`` and ``max_age`` seconds.
+
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+
+import hashlib
+import struct
+import time
+
+from .workflow import LockFile, atomic_writer
+
+__all__ = ['BloomFilter']
+
+#: Identifies Bloom filter files (and their layout version)
+MAGIC = b'AWBF\x01'
+
+# File header: magic, number of bits per filter, number of hashes,
+# time current filter was started
+_HEADER = struct.Struct(str('<5sIId'))
+
+
+class BloomFilter(object):
+    """Bloom filter with expiring keys, saved to ``filepath``.
+
+    :param filepath: path of the filter file. It is created if it
+        doesn't exist or has a different layout.
+    :type filepath: ``unicode``
+    :param bits: size of each filter in bits. With the default 4
+        hashes, 64 Kbit filters hold about 6000 keys at a 1% false
+        positive rate.
+    :type bits: ``int``
+    :param hashes: number of bits set per key
+    :type hashes: ``int``
+    :param max_age: seconds keys are remembered for at most. ``0``
+        means keys never expire.
+    :type max_age: ``int``
+
+    """
+
+    def __init__(self, filepath, bits=65536, hashes=4, max_age=0):
+        """Create new :class:`BloomFilter` object."""
+        self.filepath = filepath
+        self.bits = bits - bits % 8
+        self.hashes = hashes
+        self.max_age = max_age
+
+    def add(self, key):
+        """Add ``key`` to the filter.
+
+        :param key: key to add
+        :type key: ``unicode``
+
+        """
+        with LockFile(self.filepath):
+            created, current, previous = self._load()
+            now = time.time()
+            if self.max_age and now - created >= self.max_age / 2.0:
+                if now - created >= self.max_age:
+                    previous = bytearray(self.bits // 8)
+                else:
+                    previous = current
+                current = bytearray(self.bits // 8)
+                created = now
+
+            for index in self._indexes(key):
+                current[index // 8] |= 1 << (index % 8)
+
+            with atomic_writer(self.filepath, 'wb') as file_obj:
+                file_obj.write(_HEADER.pack(MAGIC, self.bits, self.hashes,
+                                            created))
+                file_obj.write(bytes(current))
+                file_obj.write(bytes(previous))
+
+    def __contains__(self, key):
+        """Whether ``key`` has (probably) been added to the filter.
+
+        :param key: key to look up
+        :type key: ``unicode``
+        :returns: ``False`` if ``key`` definitely hasn't been added
+            (or has expired), ``True`` if it probably has
+        :rtype: ``Boolean``
+
+        """
+        created, current, previous = self._load()
+        filters = [current, previous]
+        if self.max_age:
+            age = time.time() - created
+            if age >= self.max_age:
+                return False
+            if age >= self.max_age / 2.0:
+                filters = [current]
+
+        indexes = list(self._indexes(key))
+        for bits in filters:
+            if all(bits[i // 8] & (1 << (i % 8)) for i in indexes):
+                return True
+        return False
+
+    def _indexes(self, key):
+        """Yield indexes of the bits for ``key``."""
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        digest = hashlib.md5(key).digest()
+        first, second = struct.unpack(str('<QQ'), digest)
+        for i in range(self.hashes):
+            yield (first + i * second) % self.bits
+
+    def _load(self):
+        """Return time current filter was started and both filters."""
+        size = self.bits // 8
+        try:
+            with open(self.filepath, 'rb') as file_obj:
+                data = file_obj.read()
+            magic, bits, hashes, created = _HEADER.unpack_from(data)
+            if ((magic, bits, hashes) == (MAGIC, self.bits, self.hashes) and
+                    len(data) == _HEADER.size + 2 * size):
+                start = _HEADER.size
+                return (created, bytearray(data[start:start + size]),
+                        bytearray(data[start + size:]))
+        except (IOError, OSError, struct.error):
+            pass
+        return time.time(), bytearray(size), bytearray(size)
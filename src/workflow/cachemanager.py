@@ -0,0 +1,217 @@
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""Keep a workflow's cache directory within a size budget.
+
+:meth:`Workflow.clear_cache() <workflow.workflow.Workflow.clear_cache>`
+deletes everything at once. :class:`CacheManager` instead removes
+expired files (by name pattern) and, if the cache is still over budget,
+the least recently used ones.
+
+:meth:`Workflow.cached_data() <workflow.workflow.Workflow.cached_data>`
+updates the access time of the files it reads, so "least recently used"
+means least recently read *or* written.
+
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+
+import fnmatch
+import os
+import time
+
+from .workflow import LockFile
+
+__all__ = ['CacheManager']
+
+#: Files that are never deleted: half-written files, queued background
+#: tasks and files held open by running processes
+DEFAULT_PROTECTED = ('*.aw.temp', '*.log', '*.log.*', '*.hotcache',
+                     '*.task')
+
+
+def _process_exists(pid):
+    """Whether a process with PID ``pid`` exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class CacheManager(object):
+    """Expire and evict files in a workflow's cache directory.
+
+    :param wf: the workflow whose :attr:`~workflow.workflow.Workflow.cachedir`
+        to manage
+    :type wf: :class:`~workflow.workflow.Workflow`
+    :param max_bytes: maximum total size of cache files in bytes.
+        ``0`` means no limit.
+    :type max_bytes: ``int``
+    :param max_entries: maximum number of cache files. ``0`` means no
+        limit.
+    :type max_entries: ``int``
+    :param ttls: mapping of filename patterns (as understood by
+        :mod:`fnmatch`) to the number of seconds matching files are
+        kept after they were last modified.
+    :type ttls: ``dict``
+    :param interval: minimum number of seconds between sweeps run by
+        :meth:`maybe_sweep`
+    :type interval: ``int``
+    :param protected: filename patterns of files that are never deleted
+    :type protected: ``tuple``
+
+    """
+
+    def __init__(self, wf, max_bytes=50 * 1024 * 1024, max_entries=2000,
+                 ttls=None, interval=3600, protected=DEFAULT_PROTECTED):
+        """Create new :class:`CacheManager` object."""
+        self.wf = wf
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.interval = interval
+        self.protected = protected
+
+    @property
+    def stamp_path(self):
+        """File whose modification time records the last sweep."""
+        return self.wf.cachefile('.cachemanager.stamp')
+
+    @property
+    def due(self):
+        """``True`` if last sweep was more than :attr:`interval` ago."""
+        try:
+            last = os.stat(self.stamp_path).st_mtime
+        except OSError:
+            return True
+        return time.time() - last >= self.interval
+
+    def maybe_sweep(self):
+        """Call :meth:`sweep` if it's :attr:`due`.
+
+        This is cheap enough to call on every run: most of the time it
+        only ``stat()``-s one file.
+
+        :returns: ``(files, bytes)`` deleted or ``None`` if the sweep
+            wasn't due
+        :rtype: ``tuple`` or ``None``
+
+        """
+        if not self.due:
+            return None
+        return self.sweep()
+
+    def sweep(self):
+        """Delete expired files, then evict LRU files until within budget.
+
+        :returns: number of files and number of bytes deleted
+        :rtype: ``tuple`` (``int``, ``int``)
+
+        """
+        # Update stamp first, so concurrent runs don't sweep, too
+        with open(self.stamp_path, 'ab'):
+            os.utime(self.stamp_path, None)
+
+        now = time.time()
+        entries = []
+        deleted = freed = 0
+        for path, st in self._files():
+            # Lock files are only deleted once the file they protect
+            # is gone and nobody holds the lock
+            if path.endswith('.lock'):
+                if (not os.path.exists(path[:-len('.lock')]) and
+                        self._reap_lock(path)):
+                    deleted += 1
+                continue
+            # PID files of running tasks must stay put
+            if path.endswith('.pid') and self._pid_alive(path):
+                continue
+            if self._expired(path, st, now):
+                if self._delete(path):
+                    deleted += 1
+                    freed += st.st_size
+                continue
+            entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        entries.sort()
+        for _, size, path in entries:
+            if ((not self.max_bytes or total <= self.max_bytes) and
+                    (not self.max_entries or count <= self.max_entries)):
+                break
+            if self._delete(path):
+                deleted += 1
+                freed += size
+                total -= size
+                count -= 1
+
+        self.wf.logger.debug('Cache sweep deleted %d file(s), %d bytes',
+                             deleted, freed)
+        return deleted, freed
+
+    def _files(self):
+        """Yield ``(path, stat)`` for every deletable file in cache."""
+        for dirpath, _, filenames in os.walk(self.wf.cachedir):
+            for filename in filenames:
+                if self._is_protected(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                if path == self.stamp_path:
+                    continue
+                try:
+                    yield path, os.stat(path)
+                except OSError:  # deleted by another process
+                    continue
+
+    def _is_protected(self, filename):
+        """Whether ``filename`` matches a protected pattern."""
+        for pattern in self.protected:
+            if fnmatch.fnmatch(filename, pattern):
+                return True
+        return False
+
+    def _expired(self, path, st, now):
+        """Whether file at ``path`` has outlived its TTL."""
+        filename = os.path.basename(path)
+        if filename.endswith('.pid'):  # process has exited
+            return True
+
+        for pattern, ttl in self.ttls.items():
+            if fnmatch.fnmatch(filename, pattern):
+                return now - st.st_mtime >= ttl
+        return False
+
+    def _pid_alive(self, path):
+        """Whether PID file at ``path`` belongs to a running process."""
+        try:
+            with open(path, 'rb') as file_obj:
+                return _process_exists(int(file_obj.read().strip()))
+        except (IOError, OSError, ValueError):
+            return False
+
+    def _reap_lock(self, path):
+        """Delete lock file at ``path`` if no process holds the lock."""
+        lock = LockFile(path[:-len('.lock')])
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            return self._delete(path)
+        finally:
+            lock.release()
+
+    def _delete(self, path):
+        """Delete file at ``path``, ignoring files that are already gone."""
+        try:
+            os.unlink(path)
+        except OSError:
+            return False
+        self.wf.logger.debug('Deleted : %r', path)
+        return True
@@ -0,0 +1,218 @@
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""Track the health of network endpoints and stop using failing ones.
+
+:class:`CircuitBreaker` keeps the outcome and latency of recent
+requests to each endpoint in the workflow's cache directory, so every
+process of a workflow shares them. Once too many of the recent
+requests to an endpoint have failed, its circuit "opens": callers
+should check :meth:`CircuitBreaker.allow` and not make requests to it
+(e.g. show cached results instead) rather than wait for each one to
+time out.
+
+After a cooldown, the circuit is "half-open": it is still closed to
+callers, but :meth:`CircuitBreaker.probes_due` lists the endpoint, so a
+background job can make a single test request. If the probe succeeds,
+the circuit closes again. If it fails, the circuit stays open for
+twice as long.
+
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+
+import time
+
+from .workflow import LockFile
+
+__all__ = ['CircuitBreaker', 'CircuitOpen']
+
+
+class CircuitOpen(Exception):
+    """Raised when a request isn't made because its endpoint's circuit
+    is open."""
+
+
+class CircuitBreaker(object):
+    """Shared health tracker and circuit breaker for endpoints.
+
+    Endpoints can be any string that identifies them, e.g. their URL.
+
+    :param wf: the workflow whose
+        :attr:`~workflow.workflow.Workflow.cachedir` to save state in
+    :type wf: :class:`~workflow.workflow.Workflow`
+    :param name: name the state is cached under
+    :type name: ``unicode``
+    :param window: number of recent requests kept per endpoint
+    :type window: ``int``
+    :param max_age: requests older than this many seconds are forgotten
+    :type max_age: ``int``
+    :param min_requests: the circuit can only open once at least this
+        many recent requests were made
+    :type min_requests: ``int``
+    :param max_error_rate: share of recent requests (0-1) that must have
+        failed for the circuit to open
+    :type max_error_rate: ``float``
+    :param cooldown: seconds before the first probe of an open circuit
+    :type cooldown: ``int``
+    :param max_cooldown: longest cooldown after failed probes
+    :type max_cooldown: ``int``
+
+    """
+
+    def __init__(self, wf, name='circuits', window=50, max_age=300,
+                 min_requests=5, max_error_rate=0.5, cooldown=30,
+                 max_cooldown=600):
+        """Create new :class:`CircuitBreaker` object."""
+        self.wf = wf
+        self.name = name
+        self.window = window
+        self.max_age = max_age
+        self.min_requests = min_requests
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+    def allow(self, endpoint):
+        """Whether requests may be made to ``endpoint``.
+
+        :param endpoint: endpoint to check
+        :type endpoint: ``unicode``
+        :returns: ``False`` if the endpoint's circuit is open
+        :rtype: ``Boolean``
+
+        """
+        return self._load().get(endpoint, {}).get('opened') is None
+
+    def record(self, endpoint, latency, ok=True, probe=False):
+        """Record a request to ``endpoint`` and open or close its
+        circuit accordingly.
+
+        :param endpoint: endpoint the request was made to
+        :type endpoint: ``unicode``
+        :param latency: seconds the request took
+        :type latency: ``float``
+        :param ok: whether the request succeeded. Timeouts are failures.
+            ``None`` if the outcome is unknown (e.g. the request was
+            abandoned): the request is then neither a success nor a
+            failure, and its latency is left out of the percentiles.
+        :type ok: ``Boolean`` or ``None``
+        :param probe: whether the request was a probe of an open
+            circuit. A successful probe closes the circuit, a failed
+            one doubles its cooldown.
+        :type probe: ``Boolean``
+
+        """
+        with LockFile(self.wf.cachefile(self.name)):
+            circuits = self._load()
+            now = time.time()
+            circuit = circuits.setdefault(
+                endpoint, {'requests': [], 'opened': None,
+                           'cooldown': self.cooldown})
+            requests = [r for r in circuit['requests']
+                        if now - r[0] < self.max_age]
+            circuit['requests'] = (requests +
+                                   [(now, latency, ok)])[-self.window:]
+
+            if probe and ok:
+                self.wf.logger.info('Circuit for %s closed', endpoint)
+                # Failures from before the outage mustn't reopen it
+                circuit.update(requests=[(now, latency, ok)], opened=None,
+                               cooldown=self.cooldown)
+            elif probe:
+                circuit.update(opened=now, cooldown=min(
+                    circuit['cooldown'] * 2, self.max_cooldown))
+            elif circuit['opened'] is None and self._unhealthy(circuit):
+                self.wf.logger.warning('Circuit for %s opened', endpoint)
+                circuit.update(opened=now, cooldown=self.cooldown)
+            self.wf.cache_data(self.name, circuits)
+
+    def probes_due(self):
+        """Return endpoints whose circuit is open and due to be probed.
+
+        :returns: endpoints to probe
+        :rtype: ``list``
+
+        """
+        now = time.time()
+        return [endpoint for endpoint, circuit in self._load().items()
+                if circuit['opened'] is not None and
+                now - circuit['opened'] >= circuit['cooldown']]
+
+    def percentile(self, endpoint, percent):
+        """Return latency of recent successful requests to ``endpoint``
+        at ``percent``-th percentile.
+
+        :param endpoint: endpoint to return latency of
+        :type endpoint: ``unicode``
+        :param percent: percentile (0-100), e.g. ``50`` for the median
+        :type percent: ``int``
+        :returns: latency in seconds or ``None`` if no recent requests
+            succeeded
+        :rtype: ``float``
+
+        """
+        return self._percentile(self._load().get(endpoint, {}), percent)
+
+    def health(self):
+        """Return the state of all endpoints, e.g. for display.
+
+        :returns: mapping of endpoints to a ``dict`` with the keys
+            ``state`` (``closed``, ``open`` or ``half-open``),
+            ``requests``, ``error_rate`` and latency percentiles ``p50``,
+            ``p90`` and ``p99``
+        :rtype: ``dict``
+
+        """
+        due = self.probes_due()
+        health = {}
+        for endpoint, circuit in self._load().items():
+            if circuit['opened'] is None:
+                state = 'closed'
+            elif endpoint in due:
+                state = 'half-open'
+            else:
+                state = 'open'
+            health[endpoint] = {
+                'state': state,
+                'requests': len(circuit['requests']),
+                'error_rate': self._error_rate(circuit),
+            }
+            for percent in (50, 90, 99):
+                health[endpoint]['p{0}'.format(percent)] = \
+                    self._percentile(circuit, percent)
+        return health
+
+    def _load(self):
+        """Return state of all circuits."""
+        return self.wf.cached_data(self.name, max_age=0) or {}
+
+    def _unhealthy(self, circuit):
+        """Whether too many recent requests of ``circuit`` failed."""
+        known = [r for r in circuit['requests'] if r[2] is not None]
+        return (len(known) >= self.min_requests and
+                self._error_rate(circuit) >= self.max_error_rate)
+
+    def _error_rate(self, circuit):
+        """Return share of recent requests of ``circuit`` with a known
+        outcome that failed."""
+        known = [r for r in circuit['requests'] if r[2] is not None]
+        if not known:
+            return 0.0
+        failed = len([r for r in known if not r[2]])
+        return float(failed) / len(known)
+
+    def _percentile(self, circuit, percent):
+        """Return latency percentile of successful requests of
+        ``circuit`` (nearest rank)."""
+        latencies = sorted(r[1] for r in circuit.get('requests', []) if r[2])
+        if not latencies:
+            return None
+        rank = int(round(percent / 100.0 * (len(latencies) - 1)))
+        return latencies[rank]
@@ -0,0 +1,249 @@
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""Shared-memory cache for small, frequently-read data.
+
+Every run of a Script Filter is a new process, so anything it decodes
+is thrown away when it exits. :class:`HotCache` keeps recently-used
+serialized objects in a fixed-size file that is memory-mapped by every
+process that uses it, so back-to-back and concurrent runs can share
+data without opening and reading a separate cache file for each key.
+
+The file is divided into a fixed number of equally-sized slots. When
+all slots are in use, the least recently accessed one is reused.
+
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+
+import hashlib
+import io
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from .workflow import LockFile, manager
+
+__all__ = ['HotCache']
+
+#: Identifies hot cache files (and their layout version)
+MAGIC = b'AWHC\x01'
+
+# File header: magic, number of slots, size of each slot's payload
+_FILE_HEADER = struct.Struct(str('<5sII'))
+# Slot header: key digest, time stored, time last read, payload
+# length and payload CRC32
+_SLOT_HEADER = struct.Struct(str('<16sddII'))
+# Offset of `accessed` field within slot header
+_ACCESSED_OFFSET = 16 + 8
+
+
+def _crc32(data):
+    """Return unsigned CRC32 checksum of ``data``."""
+    return zlib.crc32(data) & 0xffffffff
+
+
+class HotCache(object):
+    """Fixed-size, LRU-evicted cache shared between processes via mmap.
+
+    Writes are serialised with a :class:`~workflow.workflow.LockFile`.
+    Reads take no lock: each slot stores a checksum of its payload, and
+    a slot that is being overwritten while it is read is treated as a
+    cache miss.
+
+    :param filepath: path of the cache file. It is created if it
+        doesn't exist or has a different layout.
+    :type filepath: ``unicode``
+    :param slots: number of objects the cache can hold
+    :type slots: ``int``
+    :param slot_size: maximum size of a serialized object in bytes.
+        Larger objects are not cached.
+    :type slot_size: ``int``
+    :param serializer: name of registered serializer to use
+    :type serializer: ``unicode``
+
+    """
+
+    def __init__(self, filepath, slots=32, slot_size=65536,
+                 serializer='cpickle'):
+        """Create new :class:`HotCache` object."""
+        self.filepath = filepath
+        self.slots = slots
+        self.slot_size = slot_size
+        self.serializer = manager.serializer(serializer)
+        if self.serializer is None:
+            raise ValueError('Unknown serializer : `{0}`'.format(serializer))
+        self._map = None
+
+    @property
+    def size(self):
+        """Size of the cache file in bytes."""
+        return (_FILE_HEADER.size +
+                self.slots * (_SLOT_HEADER.size + self.slot_size))
+
+    def get(self, key, max_age=0):
+        """Return object cached under ``key`` or ``None``.
+
+        :param key: key object was cached under
+        :type key: ``unicode``
+        :param max_age: maximum age of cached object in seconds. If 0,
+            the object is returned no matter how old.
+        :type max_age: ``int``
+        :returns: cached object or ``None``
+
+        """
+        digest = self._digest(key)
+        cache = self._mmap()
+        for offset in self._slot_offsets():
+            header = _SLOT_HEADER.unpack_from(cache, offset)
+            if header[0] != digest:
+                continue
+
+            stored, length, crc = header[1], header[3], header[4]
+            if max_age and time.time() - stored >= max_age:
+                return None
+
+            start = offset + _SLOT_HEADER.size
+            payload = cache[start:start + length]
+            if _crc32(payload) != crc:  # being rewritten
+                return None
+
+            struct.pack_into(str('<d'), cache, offset + _ACCESSED_OFFSET,
+                             time.time())
+            return self.serializer.load(io.BytesIO(payload))
+
+        return None
+
+    def set(self, key, data):
+        """Cache ``data`` under ``key``.
+
+        If there is no free slot, the least recently accessed object
+        is evicted.
+
+        :param key: key to cache object under
+        :type key: ``unicode``
+        :param data: object to cache. If ``None``, the key is removed.
+        :returns: ``True`` if object was cached, ``False`` if it is too
+            large to fit in a slot.
+        :rtype: ``Boolean``
+
+        """
+        digest = self._digest(key)
+        if data is None:
+            payload = b''
+        else:
+            buf = io.BytesIO()
+            self.serializer.dump(data, buf)
+            payload = buf.getvalue()
+            if len(payload) > self.slot_size:
+                return False
+
+        cache = self._mmap()
+        with LockFile(self.filepath):
+            offset = self._find_slot(cache, digest)
+            if data is None:
+                if offset is not None:
+                    cache[offset:offset + 16] = b'\x00' * 16
+                return True
+
+            if offset is None:
+                offset = self._lru_slot(cache)
+
+            now = time.time()
+            start = offset + _SLOT_HEADER.size
+            # Invalidate slot before overwriting payload, so concurrent
+            # readers never see the old key with the new payload
+            cache[offset:offset + 16] = b'\x00' * 16
+            cache[start:start + len(payload)] = payload
+            _SLOT_HEADER.pack_into(cache, offset, digest, now, now,
+                                   len(payload), _crc32(payload))
+
+        return True
+
+    def delete(self, key):
+        """Remove object cached under ``key``.
+
+        :param key: key object was cached under
+        :type key: ``unicode``
+
+        """
+        self.set(key, None)
+
+    def close(self):
+        """Unmap cache file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _digest(self, key):
+        """Return 16-byte digest of ``key``."""
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return hashlib.md5(key).digest()
+
+    def _slot_offsets(self):
+        """Yield offset of each slot header in the cache file."""
+        step = _SLOT_HEADER.size + self.slot_size
+        for i in range(self.slots):
+            yield _FILE_HEADER.size + i * step
+
+    def _find_slot(self, cache, digest):
+        """Return offset of slot holding ``digest`` or ``None``."""
+        for offset in self._slot_offsets():
+            if cache[offset:offset + 16] == digest:
+                return offset
+        return None
+
+    def _lru_slot(self, cache):
+        """Return offset of empty or least recently accessed slot."""
+        empty = b'\x00' * 16
+        oldest = None
+        for offset in self._slot_offsets():
+            header = _SLOT_HEADER.unpack_from(cache, offset)
+            if header[0] == empty:
+                return offset
+            if oldest is None or header[2] < oldest[1]:
+                oldest = (offset, header[2])
+        return oldest[0]
+
+    def _mmap(self):
+        """Map cache file into memory, creating it if necessary."""
+        if self._map is not None:
+            return self._map
+
+        header = _FILE_HEADER.pack(MAGIC, self.slots, self.slot_size)
+        if not self._valid(header):
+            with LockFile(self.filepath):
+                if not self._valid(header):
+                    self._create(header)
+
+        with open(self.filepath, 'r+b') as file_obj:
+            self._map = mmap.mmap(file_obj.fileno(), self.size)
+
+        return self._map
+
+    def _valid(self, header):
+        """Whether cache file exists and has the expected layout."""
+        try:
+            if os.path.getsize(self.filepath) != self.size:
+                return False
+            with open(self.filepath, 'rb') as file_obj:
+                return file_obj.read(len(header)) == header
+        except (IOError, OSError):
+            return False
+
+    def _create(self, header):
+        """Create empty cache file."""
+        temp_path = '{0}.{1}.temp'.format(self.filepath, os.getpid())
+        with open(temp_path, 'wb') as file_obj:
+            file_obj.write(header)
+            file_obj.truncate(self.size)
+        os.rename(temp_path, self.filepath)
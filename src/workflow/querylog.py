@@ -0,0 +1,230 @@
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""Record what users search for and how often.
+
+:class:`QueryLog` appends each query to a log file in the workflow's
+data directory. :meth:`QueryLog.compact` folds the log into a score
+per query that decays over time, so recent queries rank above ones
+that were popular months ago. :meth:`QueryLog.top` returns the
+highest-scoring queries, e.g. for filling a cache ahead of demand.
+If queries are normalized before they're logged, the text the user
+typed can be logged with them and looked up with :meth:`QueryLog.texts`.
+
+A Script Filter runs on every keystroke, so a user looking for
+"einstein" also logs "e", "ei", "ein" etc. While compacting, a query
+that is followed within a few seconds by a longer (or shorter) version
+of itself is dropped, so only the query the user settled on counts.
+
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+
+import os
+import time
+
+from .workflow import LockFile
+
+__all__ = ['QueryLog']
+
+
+class QueryLog(object):
+    """Append-only query log with time-decayed frequency counts.
+
+    :param wf: the workflow whose
+        :attr:`~workflow.workflow.Workflow.datadir` to save the log in
+    :type wf: :class:`~workflow.workflow.Workflow`
+    :param name: name of the log. Files in the data directory are
+        named after it.
+    :type name: ``unicode``
+    :param half_life: seconds after which a query's weight has halved
+    :type half_life: ``int``
+    :param max_queries: number of queries to keep scores for
+    :type max_queries: ``int``
+    :param min_score: queries whose score has decayed below this are
+        forgotten
+    :type min_score: ``float``
+    :param typing_window: queries logged within this many seconds of a
+        longer or shorter version of themselves are not counted
+    :type typing_window: ``int``
+
+    """
+
+    def __init__(self, wf, name='queries', half_life=7 * 24 * 3600,
+                 max_queries=500, min_score=0.05, typing_window=5):
+        """Create new :class:`QueryLog` object."""
+        self.wf = wf
+        self.name = name
+        self.half_life = half_life
+        self.max_queries = max_queries
+        self.min_score = min_score
+        self.typing_window = typing_window
+
+    @property
+    def log_path(self):
+        """File queries are appended to."""
+        return self.wf.datafile('{0}.log'.format(self.name))
+
+    @property
+    def stats_name(self):
+        """Name scores are stored under."""
+        return '{0}-stats'.format(self.name)
+
+    def record(self, query, timestamp=None, text=None):
+        """Append ``query`` to the log.
+
+        This is a single ``write()`` to a file opened in append mode, so
+        it's cheap enough to call on every run.
+
+        :param query: query to record. Normalize it first, so that
+            equivalent queries are counted together.
+        :type query: ``unicode``
+        :param timestamp: when query was made. Defaults to now.
+        :type timestamp: ``float``
+        :param text: the query as the user typed it, if ``query`` was
+            normalized
+        :type text: ``unicode``
+
+        """
+        query = ' '.join(query.split())
+        if not query:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        fields = [str(int(timestamp)), query]
+        text = ' '.join((text or '').split())
+        if text and text != query:
+            fields.append(text)
+        line = ('\t'.join(fields) + '\n').encode('utf-8')
+
+        # Shared lock: any number of processes may append at once, but
+        # not while `compact()` is swapping the log out
+        with LockFile(self.log_path, shared=True):
+            fd = os.open(self.log_path,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def compact(self):
+        """Fold logged queries into scores and empty the log.
+
+        :returns: number of log entries that were counted
+        :rtype: ``int``
+
+        """
+        pending = self.log_path + '.compacting'
+        with LockFile(self.wf.datafile(self.stats_name)):
+            # A compaction that crashed may have left a log behind
+            if not os.path.exists(pending):
+                with LockFile(self.log_path):
+                    if not os.path.exists(self.log_path):
+                        return 0
+                    os.rename(self.log_path, pending)
+
+            entries = self._read(pending)
+            now = time.time()
+            scores = self.scores(now)
+            texts = self.texts()
+            for timestamp, query, text in self._settled(entries):
+                weight = self._decay(now - timestamp)
+                scores[query] = scores.get(query, 0) + weight
+                if text:
+                    texts[query] = text
+                else:
+                    texts.pop(query, None)
+
+            scores = dict(sorted(
+                [(q, s) for q, s in scores.items() if s >= self.min_score],
+                key=lambda t: t[1], reverse=True)[:self.max_queries])
+            texts = dict((q, t) for q, t in texts.items() if q in scores)
+            self.wf.store_data(self.stats_name,
+                               {'time': now, 'scores': scores,
+                                'texts': texts})
+            os.unlink(pending)
+
+        self.wf.logger.debug('Compacted %d logged queries into %d scores',
+                             len(entries), len(scores))
+        return len(entries)
+
+    def scores(self, now=None):
+        """Return scores of queries as of the last :meth:`compact`.
+
+        :param now: time to decay scores to. Defaults to now.
+        :type now: ``float``
+        :returns: mapping of queries to scores
+        :rtype: ``dict``
+
+        """
+        stats = self.wf.stored_data(self.stats_name)
+        if not stats:
+            return {}
+        if now is None:
+            now = time.time()
+        decay = self._decay(now - stats['time'])
+        return dict((q, s * decay) for q, s in stats['scores'].items())
+
+    def texts(self):
+        """Return the text last typed for queries, as of the last
+        :meth:`compact`.
+
+        :returns: mapping of queries to the text logged with them.
+            Queries logged without a text are left out.
+        :rtype: ``dict``
+
+        """
+        stats = self.wf.stored_data(self.stats_name)
+        if not stats:
+            return {}
+        return dict(stats.get('texts', {}))
+
+    def top(self, count=10):
+        """Compact the log and return the highest-scoring queries.
+
+        :param count: maximum number of queries to return
+        :type count: ``int``
+        :returns: queries, most frequent first
+        :rtype: ``list``
+
+        """
+        self.compact()
+        scores = self.scores()
+        return sorted(scores, key=lambda q: scores[q], reverse=True)[:count]
+
+    def _decay(self, age):
+        """Return weight of something ``age`` seconds old."""
+        return 0.5 ** (max(age, 0) / float(self.half_life))
+
+    def _read(self, path):
+        """Return ``(timestamp, query, text)`` entries of log at
+        ``path``."""
+        entries = []
+        with open(path, 'rb') as file_obj:
+            for line in file_obj:
+                try:
+                    fields = line.decode('utf-8').strip().split('\t')
+                    timestamp, query = fields[:2]
+                    text = fields[2] if len(fields) > 2 else None
+                    entries.append((int(timestamp), query, text))
+                except ValueError:  # partially-written line
+                    continue
+        entries.sort(key=lambda t: t[0])
+        return entries
+
+    def _settled(self, entries):
+        """Yield entries that weren't immediately edited or repeated."""
+        for i, (timestamp, query, text) in enumerate(entries):
+            if i + 1 < len(entries):
+                next_timestamp, next_query = entries[i + 1][:2]
+                if (next_timestamp - timestamp <= self.typing_window and
+                        (next_query.startswith(query) or
+                         query.startswith(next_query))):
+                    continue
+            yield timestamp, query, text
@@ -0,0 +1,131 @@
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""Limit the rate of requests made by all processes of a workflow.
+
+:class:`TokenBucket` keeps its state in the workflow's cache directory
+and updates it under a :class:`~workflow.workflow.LockFile`, so a
+Script Filter and any background jobs draw from the same bucket. Each
+request takes a token; tokens are added at a fixed rate up to a
+maximum, which allows short bursts.
+
+Callers are either priority (e.g. a user waiting for results) or
+speculative (e.g. prefetching). Speculative callers can't take the last
+few tokens, which are left for priority callers.
+
+If a server says to slow down (e.g. with a ``Retry-After`` header),
+:meth:`TokenBucket.pause` stops all callers for a while.
+
+"""
+
+from __future__ import print_function, unicode_literals, absolute_import
+
+import time
+
+from .workflow import LockFile
+
+__all__ = ['TokenBucket', 'RateLimited']
+
+
+class RateLimited(Exception):
+    """Raised when a request isn't made because of a rate limit, or
+    was refused by the server for that reason."""
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter shared by a workflow's processes.
+
+    :param wf: the workflow whose
+        :attr:`~workflow.workflow.Workflow.cachedir` to save state in
+    :type wf: :class:`~workflow.workflow.Workflow`
+    :param name: name the state is cached under
+    :type name: ``unicode``
+    :param rate: tokens added per second
+    :type rate: ``float``
+    :param capacity: maximum number of tokens, i.e. the longest burst
+    :type capacity: ``int``
+    :param reserve: number of tokens only priority callers may take
+    :type reserve: ``int``
+
+    """
+
+    def __init__(self, wf, name='tokens', rate=5.0, capacity=20, reserve=5):
+        """Create new :class:`TokenBucket` object."""
+        self.wf = wf
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.reserve = reserve
+
+    def take(self, priority=True, timeout=0):
+        """Take a token, waiting up to ``timeout`` seconds for one.
+
+        :param priority: whether the caller may take reserved tokens
+        :type priority: ``Boolean``
+        :param timeout: seconds to wait for a token
+        :type timeout: ``int`` or ``float``
+        :returns: ``True`` if a token was taken, ``False`` if none
+            would be available within ``timeout``
+        :rtype: ``Boolean``
+
+        """
+        start = time.time()
+        while True:
+            wait = self._take(priority)
+            if not wait:
+                return True
+            if time.time() + wait - start > timeout:
+                self.wf.logger.debug('Rate limit reached')
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for ``seconds``.
+
+        :param seconds: how long to pause for
+        :type seconds: ``int`` or ``float``
+
+        """
+        with LockFile(self.wf.cachefile(self.name)):
+            state = self._load()
+            state['paused_until'] = max(state['paused_until'],
+                                        time.time() + seconds)
+            self.wf.cache_data(self.name, state)
+        self.wf.logger.info('Requests paused for %0.1f seconds', seconds)
+
+    def _take(self, priority):
+        """Take a token if there is one.
+
+        Return ``0`` if a token was taken, else the number of seconds
+        until there might be one.
+
+        """
+        with LockFile(self.wf.cachefile(self.name)):
+            state = self._load()
+            now = time.time()
+            if state['paused_until'] > now:
+                return state['paused_until'] - now
+
+            tokens = min(self.capacity,
+                         state['tokens'] + (now - state['time']) * self.rate)
+            needed = 1 if priority else 1 + self.reserve
+            wait = 0
+            if tokens >= needed:
+                tokens -= 1
+            else:
+                wait = (needed - tokens) / self.rate
+            state.update(tokens=tokens, time=now)
+            self.wf.cache_data(self.name, state)
+            return wait
+
+    def _load(self):
+        """Return state of bucket."""
+        return (self.wf.cached_data(self.name, max_age=0) or
+                {'tokens': self.capacity, 'time': time.time(),
+                 'paused_until': 0})
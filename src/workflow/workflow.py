@@ -24,11 +24,13 @@ from __future__ import print_function, unicode_literals
 import binascii
 from contextlib import contextmanager
 import cPickle
-from copy import deepcopy
 import errno
+import fcntl
+import io
 import json
 import logging
 import logging.handlers
+import marshal
 import os
 import pickle
 import plistlib
@@ -36,16 +38,25 @@ import re
 import shutil
 import signal
 import string
+import struct
 import subprocess
 import sys
+import threading
 import time
 import unicodedata
+import weakref
+import zlib
 
 try:
     import xml.etree.cElementTree as ET
 except ImportError:  # pragma: no cover
     import xml.etree.ElementTree as ET
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
 
 #: Sentinel for properties that haven't been set yet (that might
 #: correctly have the value ``None``)
@@ -441,6 +452,18 @@ MATCH_ALL = 127
 DEFAULT_UPDATE_FREQUENCY = 1
 
 
+####################################################################
+# Used by `Workflow.store_data` and `Workflow.stored_data`
+####################################################################
+
+#: Extension of files saved by `Workflow.store_data`
+DATA_EXTENSION = 'alfred-data'
+#: Identifies data files and the version of their header
+DATA_MAGIC = b'AWD\x01'
+# Header after magic and serializer name: payload length and CRC32
+_DATA_HEADER = struct.Struct(str('<II'))
+
+
 ####################################################################
 # Lockfile and Keychain access errors
 ####################################################################
@@ -495,6 +518,62 @@ def isascii(text):
     return True
 
 
+def pack_data(serializer_name, payload):
+    """Wrap serialized data in a self-describing container.
+
+    The container starts with :const:`DATA_MAGIC`, then the name of the
+    serializer (one length byte followed by the name), the length of
+    ``payload`` and its CRC32 checksum.
+
+    :param serializer_name: name of serializer ``payload`` was created
+        with
+    :type serializer_name: ``unicode``
+    :param payload: serialized data
+    :type payload: ``str``
+    :returns: container
+    :rtype: ``str``
+
+    """
+    name = serializer_name.encode('utf-8')
+    return b''.join([DATA_MAGIC, struct.pack(str('<B'), len(name)), name,
+                     _DATA_HEADER.pack(len(payload),
+                                       zlib.crc32(payload) & 0xffffffff),
+                     payload])
+
+
+def unpack_data(container):
+    """Return serializer name and payload from :func:`pack_data` container.
+
+    Raises :class:`ValueError` if ``container`` is not a valid
+    container or the payload is truncated or corrupt.
+
+    :param container: data created by :func:`pack_data`
+    :type container: ``str``
+    :returns: ``(serializer_name, payload)``
+    :rtype: ``tuple``
+
+    """
+    offset = len(DATA_MAGIC)
+    if container[:offset] != DATA_MAGIC:
+        raise ValueError('Not an Alfred-Workflow data file')
+
+    try:
+        size = struct.unpack_from(str('<B'), container, offset)[0]
+        offset += 1
+        name = container[offset:offset + size].decode('utf-8')
+        offset += size
+        length, crc = _DATA_HEADER.unpack_from(container, offset)
+        offset += _DATA_HEADER.size
+    except (struct.error, UnicodeDecodeError):
+        raise ValueError('Invalid data file header')
+
+    payload = container[offset:]
+    if len(payload) != length or zlib.crc32(payload) & 0xffffffff != crc:
+        raise ValueError('Data file is truncated or corrupt')
+
+    return name, payload
+
+
 ####################################################################
 # Implementation classes
 ####################################################################
@@ -695,11 +774,178 @@ class PickleSerializer(object):
         return pickle.dump(obj, file_obj, protocol=-1)
 
 
+class ZlibPickleSerializer(object):
+    """Wrapper around :mod:`cPickle` that compresses data with :mod:`zlib`.
+
+    Use this serializer for large caches: compression costs a little
+    CPU time, but the files are much smaller and quicker to read.
+
+    """
+
+    #: Compression level passed to :func:`zlib.compress`
+    level = 1
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load serialized object from open compressed pickle file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: object loaded from file
+        :rtype: object
+
+        """
+        return cPickle.loads(zlib.decompress(file_obj.read()))
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open compressed pickle file.
+
+        :param obj: Python object to serialize
+        :type obj: Python object
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        data = cPickle.dumps(obj, protocol=-1)
+        return file_obj.write(zlib.compress(data, cls.level))
+
+
+class MarshalSerializer(object):
+    """Wrapper around :mod:`marshal`.
+
+    The fastest serializer for plain data (``dict``, ``list``,
+    ``unicode``, numbers etc.), but it can't serialize instances of
+    classes, and the format may change between Python versions.
+
+    """
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load serialized object from open marshal file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: object loaded from file
+        :rtype: object
+
+        """
+        return marshal.loads(file_obj.read())
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open marshal file.
+
+        :param obj: plain Python data to serialize
+        :type obj: ``dict``, ``list``, ``unicode`` etc.
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        return file_obj.write(marshal.dumps(obj))
+
+
+class MsgpackSerializer(object):
+    """Wrapper around :mod:`msgpack`, a compact binary format.
+
+    Only registered if the ``msgpack`` package is installed. Like JSON,
+    it only supports basic data types.
+
+    """
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load serialized object from open msgpack file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: object loaded from file
+        :rtype: object
+
+        """
+        return msgpack.unpackb(file_obj.read(), raw=False)
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open msgpack file.
+
+        :param obj: data to serialize
+        :type obj: msgpack-serializable data structure
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        return file_obj.write(msgpack.packb(obj, use_bin_type=True))
+
+
+def benchmark_serializers(samples, names=None, repeat=3):
+    """Time serializers on sample data.
+
+    Each serializer dumps and loads every object in ``samples``
+    ``repeat`` times. Serializers that can't handle one of the samples,
+    or don't load it back equal to the original (e.g. JSON turns tuples
+    into lists), are reported as unsupported.
+
+    :param samples: objects to serialize
+    :type samples: ``list``
+    :param names: names of serializers to test. Default is all
+        registered serializers.
+    :type names: ``list``
+    :param repeat: number of times to dump and load each sample.
+        The fastest run is used.
+    :type repeat: ``int``
+    :returns: one ``dict`` per serializer with keys ``name``, ``dump``
+        and ``load`` (best time in seconds), ``size`` (in bytes) and
+        ``supported``. Supported serializers come first, fastest first.
+    :rtype: ``list``
+
+    """
+    results = []
+    for name in names or manager.serializers:
+        serializer = manager.serializer(name)
+        result = {'name': name, 'dump': 0.0, 'load': 0.0, 'size': 0,
+                  'supported': True}
+        try:
+            for obj in samples:
+                dump_times, load_times = [], []
+                for _ in range(repeat):
+                    buf = io.BytesIO()
+                    start = time.time()
+                    serializer.dump(obj, buf)
+                    dump_times.append(time.time() - start)
+
+                    buf.seek(0)
+                    start = time.time()
+                    loaded = serializer.load(buf)
+                    load_times.append(time.time() - start)
+
+                if loaded != obj:
+                    result['supported'] = False
+                    break
+
+                result['dump'] += min(dump_times)
+                result['load'] += min(load_times)
+                result['size'] += len(buf.getvalue())
+
+        except Exception:
+            result['supported'] = False
+
+        results.append(result)
+
+    results.sort(key=lambda r: (not r['supported'], r['dump'] + r['load'],
+                                r['size']))
+    return results
+
+
 # Set up default manager and register built-in serializers
 manager = SerializerManager()
 manager.register('cpickle', CPickleSerializer)
 manager.register('pickle', PickleSerializer)
 manager.register('json', JSONSerializer)
+manager.register('zpickle', ZlibPickleSerializer)
+manager.register('marshal', MarshalSerializer)
+if msgpack is not None:  # pragma: no cover
+    manager.register('msgpack', MsgpackSerializer)
 
 
 class Item(object):
@@ -795,20 +1041,67 @@ class Item(object):
         return root
 
 
+class _LockTimeout(Exception):
+    """Raised by ``SIGALRM`` handler to interrupt a blocking lock."""
+
+
+def _flock(fd, operation):
+    """Call :func:`fcntl.flock`, retrying if interrupted by a signal.
+
+    On Python 2, a signal whose handler doesn't raise (e.g. one held
+    back by :class:`_SignalDeferrer`) makes a blocking ``flock`` fail
+    with ``EINTR``.
+
+    """
+    while True:
+        try:
+            return fcntl.flock(fd, operation)
+        except (IOError, OSError) as err:
+            if err.errno != errno.EINTR:
+                raise
+
+
 class LockFile(object):
-    """Context manager to create lock files."""
+    """Context manager to create lock files.
+
+    The lock is an :func:`fcntl.flock` lock on ``protected_path`` +
+    ``.lock``. It's held by an open file descriptor, so the kernel
+    releases it if the process dies, and no stale lock is left behind.
+    The descriptor isn't inherited by child processes, which would
+    otherwise hold the lock until they exit. The lock file itself is
+    not deleted on release.
+
+    Waiting for a lock blocks in the kernel, so the lock is acquired
+    as soon as it's released. If ``timeout`` is set, the wait is
+    interrupted with ``SIGALRM`` (outside the main thread, where
+    signals are unavailable, the lock is polled instead).
+
+    :param protected_path: path of the file to protect
+    :type protected_path: ``unicode``
+    :param timeout: seconds to wait for the lock before raising
+        :class:`AcquisitionError`. ``0`` means wait forever.
+    :type timeout: ``int`` or ``float``
+    :param delay: longest interval between attempts when polling
+    :type delay: ``float``
+    :param shared: take a shared (reader) lock instead of an exclusive
+        (writer) one. Any number of processes may hold a shared lock
+        at the same time.
+    :type shared: ``Boolean``
 
-    def __init__(self, protected_path, timeout=0, delay=0.05):
+    """
+
+    def __init__(self, protected_path, timeout=0, delay=0.05, shared=False):
         """Create new :class:`LockFile` object."""
         self.lockfile = protected_path + '.lock'
         self.timeout = timeout
         self.delay = delay
-        self._locked = False
+        self.shared = shared
+        self._fd = None
 
     @property
     def locked(self):
         """`True` if file is locked by this instance."""
-        return self._locked
+        return self._fd is not None
 
     def acquire(self, blocking=True):
         """Acquire the lock if possible.
@@ -816,33 +1109,108 @@ class LockFile(object):
         If the lock is in use and ``blocking`` is ``False``, return
         ``False``.
 
-        Otherwise, check every `self.delay` seconds until it acquires
-        lock or exceeds `self.timeout` and raises an exception.
+        Otherwise, wait until the lock is released or `self.timeout`
+        is exceeded, in which case raise :class:`AcquisitionError`.
 
         """
+        if self._fd is not None:
+            return True
+
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
         start = time.time()
         while True:
+            fd = os.open(self.lockfile, os.O_CREAT | os.O_RDWR)
+            # Child processes would otherwise keep the lock alive
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
             try:
-                fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_RDWR)
-                with os.fdopen(fd, 'w') as fd:
-                    fd.write('{0}'.format(os.getpid()))
-                break
-            except OSError as err:
-                if err.errno != errno.EEXIST:  # pragma: no cover
-                    raise
-                if self.timeout and (time.time() - start) >= self.timeout:
-                    raise AcquisitionError('Lock acquisition timed out.')
                 if not blocking:
-                    return False
-                time.sleep(self.delay)
+                    _flock(fd, mode | fcntl.LOCK_NB)
+                elif self.timeout:
+                    self._wait(fd, mode, self.timeout - (time.time() - start))
+                else:
+                    _flock(fd, mode)
+            except (IOError, OSError) as err:
+                os.close(fd)
+                if err.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise  # pragma: no cover
+                return False
+            except BaseException:
+                os.close(fd)
+                raise
+
+            # The lock file may have been deleted (e.g. by a cache
+            # cleaner) while we waited. If so, our lock is worthless.
+            if self._is_current(fd):
+                break
+            os.close(fd)
 
-        self._locked = True
+        self._fd = fd
         return True
 
     def release(self):
-        """Release the lock by deleting `self.lockfile`."""
-        self._locked = False
-        os.unlink(self.lockfile)
+        """Release the lock."""
+        if self._fd is None:
+            return False
+        fd, self._fd = self._fd, None
+        _flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        return True
+
+    def _wait(self, fd, mode, timeout):
+        """Block until ``fd`` is locked or ``timeout`` seconds pass."""
+        if timeout <= 0:
+            raise AcquisitionError('Lock acquisition timed out.')
+
+        def handler(signum, frame):
+            raise _LockTimeout()
+
+        try:
+            old_handler = signal.signal(signal.SIGALRM, handler)
+        except ValueError:  # not main thread
+            return self._poll(fd, mode, timeout)
+
+        old_timer = signal.setitimer(signal.ITIMER_REAL, timeout)
+        locked = False
+        try:
+            try:
+                _flock(fd, mode)
+                locked = True
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except _LockTimeout:
+            # The timer fires once, so this is the only alarm. It may
+            # have gone off just after the lock was taken.
+            if not locked:
+                raise AcquisitionError('Lock acquisition timed out.')
+        finally:
+            signal.signal(signal.SIGALRM, old_handler)
+            if old_timer[0]:  # pragma: no cover
+                signal.setitimer(signal.ITIMER_REAL, *old_timer)
+
+    def _poll(self, fd, mode, timeout):
+        """Try to lock ``fd`` with backoff until ``timeout`` seconds pass."""
+        deadline = time.time() + timeout
+        interval = min(0.001, self.delay)
+        while True:
+            try:
+                _flock(fd, mode | fcntl.LOCK_NB)
+                return
+            except (IOError, OSError) as err:
+                if err.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise  # pragma: no cover
+            if time.time() >= deadline:
+                raise AcquisitionError('Lock acquisition timed out.')
+            time.sleep(interval)
+            interval = min(interval * 2, self.delay)
+
+    def _is_current(self, fd):
+        """Whether ``fd`` is still the file at ``self.lockfile``."""
+        try:
+            st = os.stat(self.lockfile)
+        except OSError:
+            return False
+        return st.st_ino == os.fstat(fd).st_ino
 
     def __enter__(self):
         """Acquire lock."""
@@ -854,8 +1222,8 @@ class LockFile(object):
         self.release()
 
     def __del__(self):
-        """Clear up `self.lockfile`."""
-        if self._locked:  # pragma: no cover
+        """Release lock if still held."""
+        if self._fd is not None:  # pragma: no cover
             self.release()
 
 
@@ -871,20 +1239,142 @@ def atomic_writer(file_path, mode):
     .. versionadded:: 1.12
 
     Context manager that ensures the file is only written if the write
-    succeeds. The data is first written to a temporary file.
+    succeeds. The data is first written to a temporary file, which is
+    unique to the process and thread, so concurrent writers of the same
+    file don't clobber each other's temporary files.
 
     """
-    temp_suffix = '.aw.temp'
+    temp_suffix = '.{0}.{1}.aw.temp'.format(os.getpid(),
+                                            threading.current_thread().ident)
     temp_file_path = file_path + temp_suffix
-    with open(temp_file_path, mode) as file_obj:
-        try:
+    try:
+        with open(temp_file_path, mode) as file_obj:
             yield file_obj
-            os.rename(temp_file_path, file_path)
-        finally:
-            try:
-                os.remove(temp_file_path)
-            except (OSError, IOError):
-                pass
+        # Rename only once the file is closed (and flushed), so readers
+        # never see it half-written
+        os.rename(temp_file_path, file_path)
+    finally:
+        try:
+            os.remove(temp_file_path)
+        except (OSError, IOError):
+            pass
+
+
+# In-process locks for paths written by `Workflow`, one per path. Only
+# locks in use are kept, so long-running processes don't collect them.
+_path_locks = weakref.WeakValueDictionary()
+_path_locks_lock = threading.Lock()
+
+
+def _path_lock(path):
+    """Return the lock threads must hold to read or write ``path``.
+
+    :param path: path of file
+    :type path: ``unicode``
+    :returns: re-entrant lock
+    :rtype: :class:`threading.RLock`
+
+    """
+    with _path_locks_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = threading.RLock()
+        return lock
+
+
+def _in_main_thread():
+    """Whether the calling thread is the main thread."""
+    if hasattr(threading, 'main_thread'):  # pragma: no cover
+        return threading.current_thread() is threading.main_thread()
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+class _SignalDeferrer(object):
+    """Process-wide ``SIGTERM`` trap used by :class:`uninterruptible`.
+
+    Counts the critical sections running in any thread and holds back
+    ``SIGTERM`` until the last one has finished. Only the main thread
+    can install signal handlers, so sections running in other threads
+    are only protected once the main thread has called :meth:`install`
+    (e.g. via :meth:`Workflow.run`).
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._caught = None
+        self._redelivered = False
+        self._old_handler = None
+
+    def install(self):
+        """Install ``SIGTERM`` handler if called from the main thread.
+
+        Checked on every call, as the workflow may have installed its
+        own handler since. Ours then replaces it and passes signals on
+        to it.
+
+        :returns: ``True`` if the handler is installed
+        :rtype: ``Boolean``
+
+        """
+        if signal.getsignal(signal.SIGTERM) == self.handler:
+            return True
+        if not _in_main_thread():
+            return False
+        self._old_handler = signal.signal(signal.SIGTERM, self.handler)
+        return True
+
+    def handler(self, signum, frame):
+        """Called when process receives SIGTERM."""
+        # Runs in the main thread, possibly while it holds `_lock`,
+        # so mustn't take it
+        if self._depth:
+            self._caught = (signum, frame)
+        else:
+            deferred, self._redelivered = self._redelivered, False
+            self._dispatch(signum, frame, deferred)
+
+    def _dispatch(self, signum, frame, deferred=False):
+        """Pass signal on to the handler that was installed before ours.
+
+        Without one, a signal that was held back exits via
+        :func:`sys.exit`, so ``finally`` blocks and cleanup still run.
+        Any other is handled by the system's default action.
+
+        """
+        old = self._old_handler
+        if callable(old):
+            old(signum, frame)
+        elif old == signal.SIG_DFL:
+            if deferred:
+                sys.exit(0)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    def __enter__(self):
+        """Start critical section."""
+        self.install()
+        with self._lock:
+            self._depth += 1
+
+    def __exit__(self, typ, value, traceback):
+        """End critical section and handle any postponed signal."""
+        pending = None
+        with self._lock:
+            self._depth -= 1
+            if not self._depth and self._caught is not None:
+                pending, self._caught = self._caught, None
+
+        if pending is not None:
+            if _in_main_thread():
+                self._dispatch(pending[0], pending[1], deferred=True)
+            else:  # let main thread handle it
+                self._redelivered = True
+                os.kill(os.getpid(), pending[0])
+
+
+_signal_deferrer = _SignalDeferrer()
 
 
 class uninterruptible(object):
@@ -904,40 +1394,26 @@ class uninterruptible(object):
     Alfred-Workflow uses this internally to ensure its settings, data
     and cache writes complete.
 
-    .. important::
-
-        This decorator is NOT thread-safe.
+    Wrapped functions may run in several threads at once: the signal
+    is handled once *all* of them have finished. Only the main thread
+    can trap signals, so functions running in other threads are only
+    protected if the main thread is running :meth:`Workflow.run` or
+    has itself called an ``uninterruptible`` function.
 
     """
 
     def __init__(self, func, class_name=''):
         """Decorate `func`."""
         self.func = func
-        self._caught_signal = None
 
     def signal_handler(self, signum, frame):
         """Called when process receives SIGTERM."""
-        self._caught_signal = (signum, frame)
+        _signal_deferrer.handler(signum, frame)
 
     def __call__(self, *args, **kwargs):
         """Trap ``SIGTERM`` and call wrapped function."""
-        self._caught_signal = None
-        # Register handler for SIGTERM, then call `self.func`
-        self.old_signal_handler = signal.getsignal(signal.SIGTERM)
-        signal.signal(signal.SIGTERM, self.signal_handler)
-
-        self.func(*args, **kwargs)
-
-        # Restore old signal handler
-        signal.signal(signal.SIGTERM, self.old_signal_handler)
-
-        # Handle any signal caught during execution
-        if self._caught_signal is not None:
-            signum, frame = self._caught_signal
-            if callable(self.old_signal_handler):
-                self.old_signal_handler(signum, frame)
-            elif self.old_signal_handler == signal.SIG_DFL:
-                sys.exit(0)
+        with _signal_deferrer:
+            return self.func(*args, **kwargs)
 
     def __get__(self, obj=None, klass=None):
         """Decorator API."""
@@ -968,24 +1444,85 @@ class Settings(dict):
         super(Settings, self).__init__()
         self._filepath = filepath
         self._nosave = False
-        self._original = {}
+        # Contents of settings file. Parsed into `_original` on demand.
+        self._raw = None
+        self._parsed_original = None
+        self._dirty = False
+        self._batch_depth = 0
+        # Serialises changes and saves made by different threads
+        self._lock = threading.RLock()
         if os.path.exists(self._filepath):
             self._load()
         elif defaults:
-            for key, val in defaults.items():
-                self[key] = val
-            self.save()  # save default settings
+            with self.batch():  # save default settings
+                for key, val in defaults.items():
+                    self[key] = val
+
+    @property
+    def _original(self):
+        """Settings as they were loaded from disk.
+
+        Only parsed (from the file contents read by :meth:`_load`) when
+        a setting is changed, so read-only use of :class:`Settings`
+        doesn't pay for a copy.
+        """
+        if self._parsed_original is None:
+            if self._raw is None:
+                self._parsed_original = {}
+            else:
+                self._parsed_original = json.loads(self._raw,
+                                                   encoding='utf-8')
+        return self._parsed_original
 
     def _load(self):
         """Load cached settings from JSON file `self._filepath`."""
-        self._nosave = True
-        d = {}
         with open(self._filepath, 'rb') as file_obj:
-            for key, value in json.load(file_obj, encoding='utf-8').items():
-                d[key] = value
-        self.update(d)
-        self._original = deepcopy(d)
-        self._nosave = False
+            self._raw = file_obj.read()
+        self._parsed_original = None
+        super(Settings, self).update(json.loads(self._raw, encoding='utf-8'))
+
+    @contextmanager
+    def batch(self):
+        """Context manager that saves all changes made within it at once.
+
+        Changing several settings normally saves the settings file once
+        per change. Inside a ``with settings.batch():`` block, changes
+        are only recorded, and the file is written once (if anything
+        changed) when the outermost block exits.
+
+        If the block raises an exception, the changes made within it
+        are discarded.
+
+        A batch applies to the whole object, so changes made by other
+        threads while it is open are also saved when it ends.
+
+        """
+        with self._lock:
+            if not self._batch_depth:
+                snapshot = dict(self)
+                self._dirty = False
+            self._batch_depth += 1
+        failed = True
+        try:
+            yield self
+            failed = False
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    if failed:
+                        super(Settings, self).clear()
+                        super(Settings, self).update(snapshot)
+                        self._dirty = False
+                    elif self._dirty:
+                        self.save()
+
+    def _changed(self):
+        """Save settings, or mark them as dirty if in a :meth:`batch`."""
+        if self._batch_depth:
+            self._dirty = True
+        else:
+            self.save()
 
     @uninterruptible
     def save(self):
@@ -997,37 +1534,45 @@ class Settings(dict):
         """
         if self._nosave:
             return
-        data = {}
-        data.update(self)
-        # for key, value in self.items():
-        #     data[key] = value
-        with LockFile(self._filepath):
-            with atomic_writer(self._filepath, 'wb') as file_obj:
-                json.dump(data, file_obj, sort_keys=True, indent=2,
-                          encoding='utf-8')
+        with self._lock:
+            data = {}
+            data.update(self)
+            # for key, value in self.items():
+            #     data[key] = value
+            with LockFile(self._filepath):
+                with atomic_writer(self._filepath, 'wb') as file_obj:
+                    json.dump(data, file_obj, sort_keys=True, indent=2,
+                              encoding='utf-8')
+            self._dirty = False
 
     # dict methods
     def __setitem__(self, key, value):
         """Implement :class:`dict` interface."""
-        if self._original.get(key) != value:
-            super(Settings, self).__setitem__(key, value)
-            self.save()
+        with self._lock:
+            if self._original.get(key) != value:
+                super(Settings, self).__setitem__(key, value)
+                self._changed()
 
     def __delitem__(self, key):
         """Implement :class:`dict` interface."""
-        super(Settings, self).__delitem__(key)
-        self.save()
+        with self._lock:
+            super(Settings, self).__delitem__(key)
+            self._changed()
 
     def update(self, *args, **kwargs):
         """Override :class:`dict` method to save on update."""
-        super(Settings, self).update(*args, **kwargs)
-        self.save()
+        with self._lock:
+            super(Settings, self).update(*args, **kwargs)
+            self._changed()
 
     def setdefault(self, key, value=None):
         """Override :class:`dict` method to save on update."""
-        ret = super(Settings, self).setdefault(key, value)
-        self.save()
-        return ret
+        with self._lock:
+            if key in self:
+                return self[key]
+            ret = super(Settings, self).setdefault(key, value)
+            self._changed()
+            return ret
 
 
 class Workflow(object):
@@ -1088,7 +1633,7 @@ class Workflow(object):
         self._bundleid = None
         self._debugging = None
         self._name = None
-        self._cache_serializer = 'cpickle'
+        self._cache_serializer = None
         self._data_serializer = 'cpickle'
         self._info = None
         self._info_loaded = False
@@ -1591,11 +2136,14 @@ class Workflow(object):
         :rtype: :class:`~workflow.workflow.Settings` instance
 
         """
-        if not self._settings:
-            self.logger.debug('Reading settings from `{0}` ...'.format(
-                              self.settings_path))
-            self._settings = Settings(self.settings_path,
-                                      self._default_settings)
+        # Empty settings are falsy, so check for `None`. Threads must
+        # share one instance, or they'd overwrite each other's changes.
+        with _path_lock(self.settings_path):
+            if self._settings is None:
+                self.logger.debug('Reading settings from `{0}` ...'.format(
+                                  self.settings_path))
+                self._settings = Settings(self.settings_path,
+                                          self._default_settings)
         return self._settings
 
     @property
@@ -1609,10 +2157,20 @@ class Workflow(object):
 
         See :class:`SerializerManager` for details.
 
+        If no serializer has been set, the one chosen by the
+        ``workflow:autoserializer`` :ref:`magic argument <magic-arguments>`
+        is used, or ``cpickle`` if there isn't one.
+
         :returns: serializer name
         :rtype: ``unicode``
 
         """
+        if self._cache_serializer is None:
+            name = self.settings.get('__workflow_cache_serializer')
+            if manager.serializer(name) is None:
+                name = 'cpickle'
+            self._cache_serializer = name
+
         return self._cache_serializer
 
     @cache_serializer.setter
@@ -1692,6 +2250,48 @@ class Workflow(object):
 
         .. versionadded:: 1.8
 
+        Data are stored in a single file that names the serializer used
+        to save them, so loading them takes one read. Data saved by
+        older versions (a data file plus a separate file naming the
+        serializer) are converted the first time they are loaded.
+
+        :param name: name of datastore
+
+        """
+        data_path = self.datafile('{0}.{1}'.format(name, DATA_EXTENSION))
+
+        try:
+            with open(data_path, 'rb') as file_obj:
+                container = file_obj.read()
+        except IOError as err:
+            if err.errno != errno.ENOENT:  # pragma: no cover
+                raise
+            with _path_lock(data_path):
+                return self._migrate_stored_data(name)
+
+        serializer_name, payload = unpack_data(container)
+        serializer = manager.serializer(serializer_name)
+
+        if serializer is None:
+            raise ValueError(
+                'Unknown serializer `{0}`. Register a corresponding '
+                'serializer with `manager.register()` '
+                'to load this data.'.format(serializer_name))
+
+        self.logger.debug('Data `{0}` stored in `{1}` format'.format(
+            name, serializer_name))
+
+        data = serializer.load(io.BytesIO(payload))
+
+        self.logger.debug('Stored data loaded from : {0}'.format(data_path))
+
+        return data
+
+    def _migrate_stored_data(self, name):
+        """Load data saved in the old two-file format and re-save them.
+
+        Returns ``None`` if there are no such data.
+
         :param name: name of datastore
 
         """
@@ -1712,9 +2312,6 @@ class Workflow(object):
                 'serializer with `manager.register()` '
                 'to load this data.'.format(serializer_name))
 
-        self.logger.debug('Data `{0}` stored in `{1}` format'.format(
-            name, serializer_name))
-
         filename = '{0}.{1}'.format(name, serializer_name)
         data_path = self.datafile(filename)
 
@@ -1728,7 +2325,9 @@ class Workflow(object):
         with open(data_path, 'rb') as file_obj:
             data = serializer.load(file_obj)
 
-        self.logger.debug('Stored data loaded from : {0}'.format(data_path))
+        self.logger.debug('Converting stored data `{0}` to new format'.format(
+            name))
+        self.store_data(name, data, serializer_name)
 
         return data
 
@@ -1739,7 +2338,8 @@ class Workflow(object):
 
         If ``data`` is ``None``, the datastore will be deleted.
 
-        Note that the datastore does NOT support mutliple threads.
+        Safe to call from multiple threads: writes to the same
+        datastore are serialised.
 
         :param name: name of datastore
         :param data: object(s) to store. **Note:** some serializers
@@ -1761,14 +2361,16 @@ class Workflow(object):
 
         serializer_name = serializer or self.data_serializer
 
-        # In order for `stored_data()` to be able to load data stored with
-        # an arbitrary serializer, yet still have meaningful file extensions,
-        # the format (i.e. extension) is saved to an accompanying file
-        metadata_path = self.datafile('.{0}.alfred-workflow'.format(name))
-        filename = '{0}.{1}'.format(name, serializer_name)
-        data_path = self.datafile(filename)
+        # The serializer's name is saved in the file's header, so
+        # `stored_data()` can load data stored with any serializer
+        data_path = self.datafile('{0}.{1}'.format(name, DATA_EXTENSION))
+
+        # Files used by older versions, which saved the serializer
+        # name in an accompanying file
+        legacy_paths = (self.datafile('.{0}.alfred-workflow'.format(name)),
+                        self.datafile('{0}.{1}'.format(name, serializer_name)))
 
-        if data_path == self.settings_path:
+        if legacy_paths[1] == self.settings_path:
             raise ValueError(
                 'Cannot save data to' +
                 '`{0}` with format `{1}`. '.format(name, serializer_name) +
@@ -1782,20 +2384,23 @@ class Workflow(object):
                 '`manager.register()` first.'.format(serializer_name))
 
         if data is None:  # Delete cached data
-            delete_paths((metadata_path, data_path))
+            with _path_lock(data_path):
+                delete_paths((data_path,) + legacy_paths)
             return
 
+        buf = io.BytesIO()
+        serializer.dump(data, buf)
+        container = pack_data(serializer_name, buf.getvalue())
+
         # Ensure write is not interrupted by SIGTERM
         @uninterruptible
         def _store():
-            # Save file extension
-            with atomic_writer(metadata_path, 'wb') as file_obj:
-                file_obj.write(serializer_name)
-
             with atomic_writer(data_path, 'wb') as file_obj:
-                serializer.dump(data, file_obj)
+                file_obj.write(container)
 
-        _store()
+        with _path_lock(data_path):
+            _store()
+            delete_paths(legacy_paths)
 
         self.logger.debug('Stored data saved at : {0}'.format(data_path))
 
@@ -1814,27 +2419,112 @@ class Workflow(object):
         :returns: cached data, return value of ``data_func`` or ``None``
             if ``data_func`` is not set
 
+        If several threads call this method for the same stale cache,
+        only one of them calls ``data_func``; the others wait for it
+        and return the data it cached.
+
         """
         serializer = manager.serializer(self.cache_serializer)
 
         cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
-        age = self.cached_data_age(name)
 
-        if (age < max_age or max_age == 0) and os.path.exists(cache_path):
+        def load():
+            """Return ``(True, data)`` if cache is fresh."""
+            age = self.cached_data_age(name)
+            if not (age < max_age or max_age == 0):
+                return False, None
+
+            try:
+                with open(cache_path, 'rb') as file_obj:
+                    self.logger.debug('Loading cached data from : %s',
+                                      cache_path)
+                    data = serializer.load(file_obj)
+            except (IOError, OSError):  # no cache
+                return False, None
+
+            # Record access time for `CacheManager`, keeping the
+            # modification time that the cache's age is based on
+            try:
+                os.utime(cache_path, (time.time(),
+                                      os.stat(cache_path).st_mtime))
+            except OSError:  # pragma: no cover
+                pass
+
+            return True, data
 
-            with open(cache_path, 'rb') as file_obj:
-                self.logger.debug('Loading cached data from : %s',
-                                  cache_path)
-                return serializer.load(file_obj)
+        found, data = load()
+        if found or not data_func:
+            return data
 
-        if not data_func:
-            return None
+        with _path_lock(cache_path):
+            # Another thread may have regenerated the data while
+            # this one was waiting for the lock
+            found, data = load()
+            if found:
+                return data
 
-        data = data_func()
-        self.cache_data(name, data)
+            data = data_func()
+            self.cache_data(name, data)
 
         return data
 
+    def cached_data_coalesced(self, name, data_func, max_age=60, timeout=5):
+        """Return cached data, letting only one process regenerate it.
+
+        Works like :meth:`cached_data`, but is intended for data that
+        several workflow processes may ask for at the same moment (e.g.
+        a Script Filter Alfred runs once per keystroke).
+
+        The first process to find the cache stale takes a
+        :class:`LockFile` on the cache file and calls ``data_func``.
+        Other processes wait for the lock and, once the holder has
+        written the cache, return that instead of calling ``data_func``
+        themselves. If the lock isn't released within ``timeout``
+        seconds, a waiting process gives up and calls ``data_func``
+        itself.
+
+        :param name: name of datastore
+        :param data_func: function to (re-)generate data.
+        :type data_func: ``callable``
+        :param max_age: maximum age of cached data in seconds. If 0,
+            any cached data is returned no matter how old.
+        :type max_age: ``int``
+        :param timeout: how long to wait for another process to
+            generate the data, in seconds
+        :type timeout: ``int`` or ``float``
+        :returns: cached data or return value of ``data_func``
+
+        """
+        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+
+        def fresh():
+            if not os.path.exists(cache_path):
+                return False
+            return max_age == 0 or self.cached_data_age(name) < max_age
+
+        if fresh():
+            return self.cached_data(name, max_age=0)
+
+        lock = LockFile(cache_path, timeout=timeout)
+        try:
+            lock.acquire()
+        except AcquisitionError:
+            self.logger.debug('Timed out waiting for cache `%s`', name)
+            data = data_func()
+            self.cache_data(name, data)
+            return data
+
+        try:
+            # Another process may have written the cache while we
+            # waited for the lock
+            if fresh():
+                return self.cached_data(name, max_age=0)
+            data = data_func()
+            self.cache_data(name, data)
+            return data
+        finally:
+            lock.release()
+
     def cache_data(self, name, data):
         """Save ``data`` to cache under ``name``.
 
@@ -1845,22 +2535,58 @@ class Workflow(object):
         :param data: data to store. This may be any object supported by
                 the cache serializer
 
+        Safe to call from multiple threads.
+
         """
         serializer = manager.serializer(self.cache_serializer)
 
         cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
 
-        if data is None:
-            if os.path.exists(cache_path):
-                os.unlink(cache_path)
-                self.logger.debug('Deleted cache file : %s', cache_path)
-            return
+        with _path_lock(cache_path):
+            if data is None:
+                if os.path.exists(cache_path):
+                    os.unlink(cache_path)
+                    self.logger.debug('Deleted cache file : %s', cache_path)
+                return
 
-        with atomic_writer(cache_path, 'wb') as file_obj:
-            serializer.dump(data, file_obj)
+            with atomic_writer(cache_path, 'wb') as file_obj:
+                serializer.dump(data, file_obj)
 
         self.logger.debug('Cached data saved at : %s', cache_path)
 
+    def benchmark_cache_serializers(self, max_samples=20, repeat=3):
+        """Benchmark registered serializers on the workflow's cached data.
+
+        Loads up to ``max_samples`` files from :attr:`cachedir` that were
+        saved by :meth:`cache_data` and passes them to
+        :func:`benchmark_serializers`.
+
+        :param max_samples: maximum number of cache files to use
+        :type max_samples: ``int``
+        :param repeat: number of times to dump and load each sample
+        :type repeat: ``int``
+        :returns: results of :func:`benchmark_serializers`, fastest first
+        :rtype: ``list``
+
+        """
+        samples = []
+        for filename in sorted(os.listdir(self.cachedir)):
+            if len(samples) >= max_samples:
+                break
+            ext = os.path.splitext(filename)[1][1:]
+            serializer = manager.serializer(ext)
+            if filename.startswith('.') or serializer is None:
+                continue
+            try:
+                with open(self.cachefile(filename), 'rb') as file_obj:
+                    samples.append(serializer.load(file_obj))
+            except Exception:
+                self.logger.debug('Could not load : %r', filename)
+
+        self.logger.debug('Benchmarking serializers on %d cache file(s)',
+                          len(samples))
+        return benchmark_serializers(samples, repeat=repeat)
+
     def cached_data_fresh(self, name, max_age):
         """Whether cache `name` is less than `max_age` seconds old.
 
@@ -2180,6 +2906,10 @@ class Workflow(object):
         """
         start = time.time()
 
+        # Trap SIGTERM, so that `uninterruptible` writes in any thread
+        # can finish before the workflow exits
+        _signal_deferrer.install()
+
         # Call workflow's entry function/method within a try-except block
         # to catch any errors and display an error message in Alfred
         try:
@@ -2724,6 +3454,32 @@ class Workflow(object):
             if not isatty:
                 self.send_feedback()
 
+        # Cache serializers
+        def show_serializers():
+            results = self.benchmark_cache_serializers()
+            for r in results:
+                self.logger.info(
+                    '%-10s supported=%s dump=%0.3fms load=%0.3fms size=%d',
+                    r['name'], r['supported'], r['dump'] * 1000,
+                    r['load'] * 1000, r['size'])
+            best = results[0]
+            if not best['supported']:
+                return 'No serializer can handle the cached data'
+            return 'Fastest cache serializer: {0} ({1:0.2f} ms, {2} B)'.format(
+                best['name'], (best['dump'] + best['load']) * 1000,
+                best['size'])
+
+        def auto_serializer():
+            best = self.benchmark_cache_serializers()[0]
+            if not best['supported']:
+                return 'No serializer can handle the cached data'
+            self.settings['__workflow_cache_serializer'] = best['name']
+            self._cache_serializer = best['name']
+            return 'Cache serializer set to {0}'.format(best['name'])
+
+        self.magic_arguments['serializers'] = show_serializers
+        self.magic_arguments['autoserializer'] = auto_serializer
+
         self.magic_arguments['help'] = do_help
         self.magic_arguments['magic'] = list_magic
         self.magic_arguments['version'] = show_version
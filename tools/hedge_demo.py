@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""hedge_demo.py [<searches> [<slow share> [<slow seconds>]]]
+
+Show how hedging requests across mirrors cuts tail latency.
+
+Starts two local HTTP servers that answer MediaWiki API queries like
+Wikipedia would, usually in 0.1 seconds, but now and again (15% of
+requests by default) only after 2 seconds. Then runs the same searches
+with `search.search()`, first with one mirror, then with both (the
+`api_urls` workflow variable), and prints the latency percentiles of
+each run and how many searches failed.
+
+Each run gets its own temporary cache and data directories, and the
+time budget is raised, so slow answers are waited for rather than cut
+off. Run with the Python the workflow runs with:
+
+    python tools/hedge_demo.py 40
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import BaseHTTPServer
+import json
+import os
+import random
+import shutil
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+FAST = 0.1
+
+
+class Mirror(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local stand-in for a MediaWiki API server."""
+
+    daemon_threads = True
+
+    def __init__(self, slow_share, slow, seed):
+        BaseHTTPServer.HTTPServer.__init__(self, (b'127.0.0.1', 0), Handler)
+        self.slow_share = slow_share
+        self.slow = slow
+        self.random = random.Random(seed)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/w/api.php'.format(self.server_port)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer search, extract and siteinfo queries."""
+
+    def do_GET(self):
+        server = self.server
+        if server.random.random() < server.slow_share:
+            time.sleep(server.slow)
+        else:
+            time.sleep(FAST)
+
+        query = dict((k, v[0]) for k, v in urlparse.parse_qs(
+                     urlparse.urlsplit(self.path).query).items())
+        if 'pageids' in query:
+            pages = [{'pageid': int(i), 'extract': 'Extract of page ' + i}
+                     for i in query['pageids'].split('|')]
+        elif 'gsrsearch' in query or 'gpssearch' in query:
+            text = (query.get('gsrsearch') or
+                    query.get('gpssearch')).decode('utf-8')
+            pages = [{'pageid': i, 'index': i, 'lastrevid': 1,
+                      'title': '{0} {1}'.format(text, i)}
+                     for i in range(1, 4)]
+        else:
+            pages = []
+        body = json.dumps({'query': {'pages': pages}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header(b'Content-Type', b'application/json')
+        self.send_header(b'Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:  # client abandoned the request
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def run(urls, searches):
+    """Run `searches` searches with API `urls` and print latencies."""
+    import search
+    from workflow import Workflow3
+
+    tempdir = tempfile.mkdtemp()
+    os.environ['alfred_workflow_cache'] = os.path.join(tempdir, 'cache')
+    os.environ['alfred_workflow_data'] = os.path.join(tempdir, 'data')
+    os.environ['api_urls'] = ' '.join(urls)
+    times = []
+    failed = 0
+    try:
+        for i in range(searches):
+            query = 'query {0}'.format(i)
+            stdout, sys.stdout = sys.stdout, StringIO()
+            start = time.time()
+            try:
+                items = search.search(Workflow3(), query)
+            finally:
+                sys.stdout = stdout
+            times.append(time.time() - start)
+            if not items or items[0]['title'] != query + ' 1':
+                failed += 1
+    finally:
+        shutil.rmtree(tempdir)
+
+    times.sort()
+
+    def percentile(percent):
+        return times[int(round(percent / 100.0 * (len(times) - 1)))]
+    print('{0} mirror(s): p50 {1:0.2f}s  p90 {2:0.2f}s  p99 {3:0.2f}s  '
+          'failed {4}/{5}'.format(len(urls), percentile(50), percentile(90),
+                                  percentile(99), failed, searches))
+
+
+if __name__ == '__main__':
+    searches = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    slow_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.15
+    slow = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+    os.environ.setdefault('alfred_workflow_bundleid', 'hedge.demo')
+    os.environ.setdefault('alfred_version', '3.8')
+    os.environ['time_budget'] = str(slow * 5)
+
+    mirrors = [Mirror(slow_share, slow, seed) for seed in (1, 2)]
+    for mirror in mirrors:
+        thread = threading.Thread(target=mirror.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    print('{0} searches, {1:0.0%} of requests take {2:0.1f}s '
+          'instead of {3:0.1f}s'.format(searches, slow_share, slow, FAST))
+    run([mirrors[0].url], searches)
+    run([mirror.url for mirror in mirrors], searches)
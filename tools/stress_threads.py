@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2026 Jonathan Beagley
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2026-10-19
+#
+
+"""stress_threads.py [<threads> [<iterations>]]
+
+Hammer a workflow's cache, data and settings stores from many threads
+at once and check that nothing is lost or corrupted:
+
+- every thread reads and writes its own cache and data entries, and
+  reads a shared cache entry that is stale to begin with, which must
+  be regenerated only once;
+- every thread changes settings, both one at a time and in batches;
+- no temporary files may be left behind.
+
+Then check that a SIGTERM received while a worker thread is in an
+`uninterruptible` function is held back until the function returns,
+and that the process then exits cleanly.
+
+Cache and data go to temporary directories. Run with the Python the
+workflow runs with, from anywhere:
+
+    python tools/stress_threads.py 16 200
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from workflow.workflow import Workflow, uninterruptible  # noqa: E402
+
+SECTION_DONE = 'section finished'
+
+
+def worker(wf, number, iterations, regenerated, errors):
+    """Mix reads and writes of the stores of `wf`."""
+    try:
+        for i in range(iterations):
+            name = 'thread-{0}'.format(number)
+            wf.cache_data(name, {'i': i, 'pad': 'x' * 1000})
+            assert wf.cached_data(name, max_age=0)['i'] == i
+
+            wf.store_data(name, [number, i])
+            assert wf.stored_data(name) == [number, i]
+
+            def regenerate():
+                regenerated.append(True)
+                time.sleep(0.05)
+                return 'shared'
+            assert wf.cached_data('shared', regenerate,
+                                  max_age=3600) == 'shared'
+
+            wf.settings[name] = i
+            with wf.settings.batch():
+                wf.settings[name + '-a'] = i
+                wf.settings[name + '-b'] = i
+    except Exception as err:
+        errors.append('thread {0}: {1!r}'.format(number, err))
+
+
+def stress(threads, iterations):
+    """Run `threads` workers and return a list of problems found."""
+    wf = Workflow()
+    regenerated = []
+    errors = []
+    workers = [threading.Thread(target=worker,
+                                args=(wf, n, iterations, regenerated, errors))
+               for n in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    print('{0} threads x {1} iterations in {2:0.1f}s'.format(
+          threads, iterations, time.time() - start))
+
+    if len(regenerated) != 1:
+        errors.append('shared cache regenerated {0} times'.format(
+                      len(regenerated)))
+
+    # Settings as saved on disk, not as held in memory
+    saved = Workflow().settings
+    for n in range(threads):
+        for suffix in ('', '-a', '-b'):
+            key = 'thread-{0}{1}'.format(n, suffix)
+            if saved.get(key) != iterations - 1:
+                errors.append('setting {0} is {1!r}'.format(
+                              key, saved.get(key)))
+
+    for dirpath in (wf.cachedir, wf.datadir):
+        for filename in os.listdir(dirpath):
+            if filename.endswith('.aw.temp'):
+                errors.append('temp file left behind: ' + filename)
+    return errors
+
+
+def sigterm_child():
+    """Receive SIGTERM while a worker thread is in a critical section."""
+    wf = Workflow()
+
+    @uninterruptible
+    def critical():
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(0.5)
+        print(SECTION_DONE)
+        sys.stdout.flush()
+
+    def main(wf):
+        thread = threading.Thread(target=critical)
+        thread.start()
+        while thread.is_alive():
+            time.sleep(0.01)
+        time.sleep(1)
+        print('still running after SIGTERM')
+
+    try:
+        wf.run(main)
+    finally:
+        print('cleanup ran')
+
+
+def check_sigterm():
+    """Return a list of problems with postponing SIGTERM."""
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--sigterm-child'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = proc.communicate()[0].decode('utf-8').split()
+    output = ' '.join(output)
+    errors = []
+    if SECTION_DONE not in output:
+        errors.append('critical section was interrupted')
+    if 'still running' in output:
+        errors.append('SIGTERM was ignored')
+    if 'cleanup ran' not in output:
+        errors.append('process was killed without cleanup')
+    if proc.returncode != 0:
+        errors.append('process exited with {0}'.format(proc.returncode))
+    return errors
+
+
+if __name__ == '__main__':
+    tempdir = tempfile.mkdtemp()
+    os.environ['alfred_workflow_cache'] = os.path.join(tempdir, 'cache')
+    os.environ['alfred_workflow_data'] = os.path.join(tempdir, 'data')
+    os.environ.setdefault('alfred_workflow_bundleid', 'stress.threads')
+    os.environ.setdefault('alfred_version', '3.8')
+    try:
+        if sys.argv[1:] == ['--sigterm-child']:
+            sigterm_child()
+            sys.exit(0)
+        threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+        iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        problems = stress(threads, iterations) + check_sigterm()
+    finally:
+        shutil.rmtree(tempdir)
+    for problem in problems:
+        print('FAIL: ' + problem)
+    if problems:
+        sys.exit(1)
+    print('OK')